@@ -0,0 +1,143 @@
+import os
+import random
+import time
+
+import numpy as np
+
+from ttxfont import GlyphBuffer, GPOS_Lookup, PairAdjustment1, PairAdjustment2, \
+    new_positionings, new_values
+from ttxread import read_ttx
+
+def random_strings(font, n, max_len=40):
+    chars = [chr(c) for c in font.charset_total]
+    random.seed(0)
+    return [''.join(random.choice(chars) for _ in range(random.randint(1, max_len))) for _ in range(n)]
+
+# Shaping many strings with increasing numbers of processes. Speedup should
+# be close to the number of workers, up to the number of cores.
+def bench_shape_many(filename, n=20000, chunksize=64):
+    font = read_ttx(filename, intern=True)
+    strings = random_strings(font, n)
+    reference = None
+    base_time = None
+    workers = 1
+    while workers <= (os.cpu_count() or 1):
+        start = time.perf_counter()
+        results = list(font.shape_many(strings, workers=workers, chunksize=chunksize))
+        elapsed = time.perf_counter() - start
+        if reference is None:
+            reference = results
+            base_time = elapsed
+        elif results != reference:
+            print('Results with', workers, 'workers differ')
+        print('workers: {}, time: {:.2f}s, strings/s: {:.0f}, speedup: {:.2f}'.format( \
+            workers, elapsed, n / elapsed, base_time / elapsed))
+        workers *= 2
+
+# Rendering text with many repeated words, as a whole and word by word.
+def bench_render_words(filename, n=2000, n_words=200, words_per_line=20):
+    font = read_ttx(filename, intern=True)
+    words = random_strings(font, n_words, max_len=8)
+    words = [w.replace(' ', '') or 'a' for w in words]
+    lines = [' '.join(random.choice(words) for _ in range(words_per_line)) for _ in range(n)]
+    buffers = [font.tokens_to_buffer(font.string_to_tokens(line)) for line in lines]
+    start = time.perf_counter()
+    results = [font.render(buffer) for buffer in buffers]
+    whole_time = time.perf_counter() - start
+    start = time.perf_counter()
+    results_words = [font.render_words(buffer) for buffer in buffers]
+    words_time = time.perf_counter() - start
+    if any(r[0] != w[0] or not np.array_equal(r[1], w[1]) or r[3] != w[2] \
+            for r, w in zip(results, results_words)):
+        print('Results of word-by-word rendering differ')
+    print('whole: {:.2f}s, words: {:.2f}s, speedup: {:.2f}, word cache: {}'.format( \
+        whole_time, words_time, whole_time / words_time, font.word_cache.stats()))
+
+# A lookup of pair adjustments on the glyphs of the font, apart from it: a
+# class matrix of n_classes x n_classes, n_pairs pairs of glyphs that also
+# adjust the second glyph, and two empty subtables, which match nothing.
+def synthetic_kerning(font, n_classes=40, n_pairs=5000):
+    random.seed(1)
+    rng = np.random.default_rng(1)
+    glyphs = list(font.glyphs)
+    classes1 = {g: random.randrange(n_classes) for g in glyphs}
+    classes2 = {g: random.randrange(n_classes) for g in glyphs}
+    class_values = new_values((n_classes, n_classes))
+    class_values['XAdvance'] = rng.integers(-100, 100, (n_classes, n_classes))
+    pairs = sorted({(random.choice(glyphs), random.choice(glyphs)) for _ in range(n_pairs)})
+    values1 = new_values(len(pairs))
+    values1['XAdvance'] = rng.integers(-100, 100, len(pairs))
+    values2 = new_values(len(pairs))
+    values2['XPlacement'] = rng.integers(-50, 50, len(pairs))
+    lookup = GPOS_Lookup('kern', '2')
+    lookup.add_positioning(PairAdjustment1([p[0] for p in pairs], [p[1] for p in pairs], \
+        values1, values2))
+    lookup.add_positioning(PairAdjustment1([], [], new_values(0), None))
+    lookup.add_positioning(PairAdjustment1([], [], new_values(0), new_values(0)))
+    lookup.add_positioning(PairAdjustment2(glyphs, classes1, classes2, class_values, None))
+    return lookup
+
+# Kerning with a large synthetic lookup of pair adjustments, pair by pair
+# and with the vectorised pass over all adjacent pairs of a buffer. The
+# lookups of the font itself are left as they are.
+def bench_pair_kerning(filename, n=2000, max_len=80):
+    font = read_ttx(filename, intern=True)
+    font.compile()
+    lookup = synthetic_kerning(font)
+    lookup.compile(font)
+    strings = random_strings(font, n, max_len)
+    buffers = [font.tokens_to_buffer(font.string_to_tokens(s)) for s in strings]
+    times = {}
+    results = {}
+    for vectorised in [False, True]:
+        font.vectorised = vectorised
+        start = time.perf_counter()
+        results[vectorised] = [lookup.apply(buffer, new_positionings(len(buffer)), font) \
+            for buffer in buffers]
+        times[vectorised] = time.perf_counter() - start
+    if any(not np.array_equal(r, v) for r, v in zip(results[False], results[True])):
+        print('Results of vectorised pair adjustments differ')
+    print('pair by pair: {:.2f}s, vectorised: {:.2f}s, speedup: {:.2f}'.format( \
+        times[False], times[True], times[False] / times[True]))
+    font.vectorised = True
+
+# Lookups of single and multiple substitutions and of single adjustments,
+# glyph by glyph and on all glyphs at once, one by one on long buffers.
+def bench_table_lookups(filename, n=1000, max_len=200):
+    font = read_ttx(filename, intern=True)
+    font.compile()
+    strings = random_strings(font, n, max_len)
+    buffers = [font.tokens_to_buffer(font.string_to_tokens(s)) for s in strings]
+    def run_gsub(lookup):
+        results = []
+        for buffer in buffers:
+            glyph_buffer = GlyphBuffer(buffer)
+            lookup.apply(glyph_buffer, font)
+            results.append(glyph_buffer.glyphs())
+        return results
+    def run_gpos(lookup):
+        return [lookup.apply(buffer, new_positionings(len(buffer)), font) for buffer in buffers]
+    lookups = [('GSUB', lookup, run_gsub) for lookup in font.GSUB_lookup_list \
+        if lookup.substitution_table is not None] + \
+        [('GPOS', lookup, run_gpos) for lookup in font.GPOS_lookup_list \
+        if lookup.adjustment_table is not None]
+    for table, lookup, run in lookups:
+        times = {}
+        results = {}
+        for vectorised in [False, True]:
+            font.vectorised = vectorised
+            start = time.perf_counter()
+            results[vectorised] = run(lookup)
+            times[vectorised] = time.perf_counter() - start
+        if any(not np.array_equal(r, v) for r, v in zip(results[False], results[True])):
+            print('Results of', table, 'lookup', lookup.index, 'on all glyphs at once differ')
+        print('{} lookup {}: glyph by glyph: {:.3f}s, at once: {:.3f}s, speedup: {:.2f}'.format( \
+            table, lookup.index, times[False], times[True], times[False] / times[True]))
+    font.vectorised = True
+
+# Worker processes that import this script must not run the benchmarks.
+if __name__ == '__main__':
+    bench_shape_many('myfont.ttx')
+    bench_render_words('myfont.ttx')
+    bench_pair_kerning('myfont.ttx')
+    bench_table_lookups('myfont.ttx')
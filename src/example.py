@@ -1,7 +1,9 @@
+import os
 from lxml import etree
 
-from ttxfont import Simulator
-from ttxread import read_ttx
+from ttxfont import Simulator, automaton_differences, coverage_class_stats, digest_stats
+from ttxread import read_ttx, read_ttx_stream, font_differences, shaping_tables, table_attributes
+from otfread import read_otf
 
 def test_read_simulate_tokens(filename, tokens):
     font = read_ttx(filename)
@@ -21,6 +23,40 @@ def test_read_simulate_string(filename, string):
     print(sim.steps_str(), end='')
     print(sim.shaped_str())
 
+def test_compare_readers(filename):
+    font1 = read_ttx(filename)
+    font2 = read_ttx_stream(filename)
+    differences = font_differences(font1, font2)
+    print('Readers agree' if len(differences) == 0 else 'Readers differ in ' + ', '.join(differences))
+
+def test_compare_otf_reader(ttx_filename, otf_filename):
+    font1 = read_ttx(ttx_filename)
+    font2 = read_otf(otf_filename)
+    attrs = [attr for table in shaping_tables for attr in table_attributes[table]]
+    differences = font_differences(font1, font2, attrs)
+    print('Readers agree' if len(differences) == 0 else 'Readers differ in ' + ', '.join(differences))
+
+def test_chain_automata(filename):
+    font = read_ttx(filename)
+    font.set_chain_automata()
+    differences = automaton_differences(font)
+    print('Automata agree' if len(differences) == 0 else \
+        'Automata differ in lookups ' + ', '.join(str(i) for i in differences))
+
+def test_coverage_classes(filename):
+    font = read_ttx(filename)
+    for (table, index), stats in sorted(coverage_class_stats(font).items()):
+        print('{} lookup {}: {} glyphs in {} coverages ({} distinct) fall into {} classes'.format( \
+            table, index, stats['glyphs'], stats['coverages'], stats['distinct_coverages'], stats['classes']))
+
+def test_digest_stats(filename, strings):
+    font = read_ttx(filename)
+    for s in strings:
+        font.shape_string(s)
+    for (table, index), stats in sorted(digest_stats(font).items()):
+        print('{} lookup {}: applied {} times, skipped {} times'.format( \
+            table, index, stats['applied'], stats['skipped']))
+
 # Two possible uses:
 
 # (1) With characters
@@ -28,3 +64,22 @@ test_read_simulate_string('myfont.ttx', '+*')
 
 # (2) With names of characters
 test_read_simulate_tokens('myfont.ttx', ['plus', 'asterisk'])
+
+# The streaming reader, for large files, should give the same font
+test_compare_readers('myfont.ttx')
+
+# The binary font from which the TTX file was dumped, if there is one: with
+# CFF outlines, whose glyph names come from the CFF charset, or TrueType
+# outlines, whose glyph names come from the post table
+for binary_filename in ['myfont.otf', 'myfont.ttf']:
+    if os.path.exists(binary_filename):
+        test_compare_otf_reader('myfont.ttx', binary_filename)
+
+# Chaining lookups matched by automata should behave as rule by rule
+test_chain_automata('myfont.ttx')
+
+# How much the coverages of chaining rules collapse into glyph classes
+test_coverage_classes('myfont.ttx')
+
+# How often lookups are skipped because no glyph of the string can start a rule
+test_digest_stats('myfont.ttx', ['+*', 'plus', 'asterisk'])
@@ -0,0 +1,776 @@
+import mmap
+import struct
+
+from ttxfont import Font, Feature, \
+	GSUB_Lookup, SingleSubstitution1, MultSubstitution, LigSubstitution, ChainSubstitution3, \
+	ChainClassRule, ChainSubstitution2, ReverseSubstitution, \
+	GPOS_Lookup, SingleAdjustment, PairAdjustment1, PairAdjustment2, MarkBaseAttachment, \
+	MarkMarkAttachment, ChainPos, new_values, set_value
+from ttxread import LazyTables, table_attributes, set_flag
+
+# Reading binary OpenType/TrueType fonts directly, giving the same fonts as
+# read_ttx on the TTX dump for the tables needed for shaping.
+
+# Glyph names of post table formats 1 and 2.
+standard_mac_names = [
+	'.notdef', '.null', 'nonmarkingreturn', 'space', 'exclam', 'quotedbl', 'numbersign',
+	'dollar', 'percent', 'ampersand', 'quotesingle', 'parenleft', 'parenright',
+	'asterisk', 'plus', 'comma', 'hyphen', 'period', 'slash', 'zero', 'one', 'two',
+	'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'colon', 'semicolon',
+	'less', 'equal', 'greater', 'question', 'at', 'A', 'B', 'C', 'D', 'E', 'F', 'G', 'H',
+	'I', 'J', 'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S', 'T', 'U', 'V', 'W', 'X', 'Y',
+	'Z', 'bracketleft', 'backslash', 'bracketright', 'asciicircum', 'underscore', 'grave',
+	'a', 'b', 'c', 'd', 'e', 'f', 'g', 'h', 'i', 'j', 'k', 'l', 'm', 'n', 'o', 'p', 'q',
+	'r', 's', 't', 'u', 'v', 'w', 'x', 'y', 'z', 'braceleft', 'bar', 'braceright',
+	'asciitilde', 'Adieresis', 'Aring', 'Ccedilla', 'Eacute', 'Ntilde', 'Odieresis',
+	'Udieresis', 'aacute', 'agrave', 'acircumflex', 'adieresis', 'atilde', 'aring',
+	'ccedilla', 'eacute', 'egrave', 'ecircumflex', 'edieresis', 'iacute', 'igrave',
+	'icircumflex', 'idieresis', 'ntilde', 'oacute', 'ograve', 'ocircumflex', 'odieresis',
+	'otilde', 'uacute', 'ugrave', 'ucircumflex', 'udieresis', 'dagger', 'degree', 'cent',
+	'sterling', 'section', 'bullet', 'paragraph', 'germandbls', 'registered', 'copyright',
+	'trademark', 'acute', 'dieresis', 'notequal', 'AE', 'Oslash', 'infinity', 'plusminus',
+	'lessequal', 'greaterequal', 'yen', 'mu', 'partialdiff', 'summation', 'product', 'pi',
+	'integral', 'ordfeminine', 'ordmasculine', 'Omega', 'ae', 'oslash', 'questiondown',
+	'exclamdown', 'logicalnot', 'radical', 'florin', 'approxequal', 'Delta',
+	'guillemotleft', 'guillemotright', 'ellipsis', 'nonbreakingspace', 'Agrave', 'Atilde',
+	'Otilde', 'OE', 'oe', 'endash', 'emdash', 'quotedblleft', 'quotedblright',
+	'quoteleft', 'quoteright', 'divide', 'lozenge', 'ydieresis', 'Ydieresis', 'fraction',
+	'currency', 'guilsinglleft', 'guilsinglright', 'fi', 'fl', 'daggerdbl',
+	'periodcentered', 'quotesinglbase', 'quotedblbase', 'perthousand', 'Acircumflex',
+	'Ecircumflex', 'Aacute', 'Edieresis', 'Egrave', 'Iacute', 'Icircumflex', 'Idieresis',
+	'Igrave', 'Oacute', 'Ocircumflex', 'apple', 'Ograve', 'Uacute', 'Ucircumflex',
+	'Ugrave', 'dotlessi', 'circumflex', 'tilde', 'macron', 'breve', 'dotaccent', 'ring',
+	'cedilla', 'hungarumlaut', 'ogonek', 'caron', 'Lslash', 'lslash', 'Scaron', 'scaron',
+	'Zcaron', 'zcaron', 'brokenbar', 'Eth', 'eth', 'Yacute', 'yacute', 'Thorn', 'thorn',
+	'minus', 'multiply', 'onesuperior', 'twosuperior', 'threesuperior', 'onehalf',
+	'onequarter', 'threequarters', 'franc', 'Gbreve', 'gbreve', 'Idotaccent', 'Scedilla',
+	'scedilla', 'Cacute', 'cacute', 'Ccaron', 'ccaron', 'dcroat'
+]
+
+# Strings of CFF tables with SIDs below 391, and the SIDs of the predefined
+# Expert and ExpertSubset charsets. The ISOAdobe charset is SIDs 0 to 228.
+cff_standard_strings = [
+	'.notdef', 'space', 'exclam', 'quotedbl', 'numbersign', 'dollar', 'percent',
+	'ampersand', 'quoteright', 'parenleft', 'parenright', 'asterisk', 'plus', 'comma',
+	'hyphen', 'period', 'slash', 'zero', 'one', 'two', 'three', 'four', 'five', 'six',
+	'seven', 'eight', 'nine', 'colon', 'semicolon', 'less', 'equal', 'greater',
+	'question', 'at', 'A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M',
+	'N', 'O', 'P', 'Q', 'R', 'S', 'T', 'U', 'V', 'W', 'X', 'Y', 'Z', 'bracketleft',
+	'backslash', 'bracketright', 'asciicircum', 'underscore', 'quoteleft', 'a', 'b',
+	'c', 'd', 'e', 'f', 'g', 'h', 'i', 'j', 'k', 'l', 'm', 'n', 'o', 'p', 'q', 'r', 's',
+	't', 'u', 'v', 'w', 'x', 'y', 'z', 'braceleft', 'bar', 'braceright', 'asciitilde',
+	'exclamdown', 'cent', 'sterling', 'fraction', 'yen', 'florin', 'section',
+	'currency', 'quotesingle', 'quotedblleft', 'guillemotleft', 'guilsinglleft',
+	'guilsinglright', 'fi', 'fl', 'endash', 'dagger', 'daggerdbl', 'periodcentered',
+	'paragraph', 'bullet', 'quotesinglbase', 'quotedblbase', 'quotedblright',
+	'guillemotright', 'ellipsis', 'perthousand', 'questiondown', 'grave', 'acute',
+	'circumflex', 'tilde', 'macron', 'breve', 'dotaccent', 'dieresis', 'ring',
+	'cedilla', 'hungarumlaut', 'ogonek', 'caron', 'emdash', 'AE', 'ordfeminine',
+	'Lslash', 'Oslash', 'OE', 'ordmasculine', 'ae', 'dotlessi', 'lslash', 'oslash',
+	'oe', 'germandbls', 'onesuperior', 'logicalnot', 'mu', 'trademark', 'Eth',
+	'onehalf', 'plusminus', 'Thorn', 'onequarter', 'divide', 'brokenbar', 'degree',
+	'thorn', 'threequarters', 'twosuperior', 'registered', 'minus', 'eth', 'multiply',
+	'threesuperior', 'copyright', 'Aacute', 'Acircumflex', 'Adieresis', 'Agrave',
+	'Aring', 'Atilde', 'Ccedilla', 'Eacute', 'Ecircumflex', 'Edieresis', 'Egrave',
+	'Iacute', 'Icircumflex', 'Idieresis', 'Igrave', 'Ntilde', 'Oacute', 'Ocircumflex',
+	'Odieresis', 'Ograve', 'Otilde', 'Scaron', 'Uacute', 'Ucircumflex', 'Udieresis',
+	'Ugrave', 'Yacute', 'Ydieresis', 'Zcaron', 'aacute', 'acircumflex', 'adieresis',
+	'agrave', 'aring', 'atilde', 'ccedilla', 'eacute', 'ecircumflex', 'edieresis',
+	'egrave', 'iacute', 'icircumflex', 'idieresis', 'igrave', 'ntilde', 'oacute',
+	'ocircumflex', 'odieresis', 'ograve', 'otilde', 'scaron', 'uacute', 'ucircumflex',
+	'udieresis', 'ugrave', 'yacute', 'ydieresis', 'zcaron', 'exclamsmall',
+	'Hungarumlautsmall', 'dollaroldstyle', 'dollarsuperior', 'ampersandsmall',
+	'Acutesmall', 'parenleftsuperior', 'parenrightsuperior', 'twodotenleader',
+	'onedotenleader', 'zerooldstyle', 'oneoldstyle', 'twooldstyle', 'threeoldstyle',
+	'fouroldstyle', 'fiveoldstyle', 'sixoldstyle', 'sevenoldstyle', 'eightoldstyle',
+	'nineoldstyle', 'commasuperior', 'threequartersemdash', 'periodsuperior',
+	'questionsmall', 'asuperior', 'bsuperior', 'centsuperior', 'dsuperior', 'esuperior',
+	'isuperior', 'lsuperior', 'msuperior', 'nsuperior', 'osuperior', 'rsuperior',
+	'ssuperior', 'tsuperior', 'ff', 'ffi', 'ffl', 'parenleftinferior',
+	'parenrightinferior', 'Circumflexsmall', 'hyphensuperior', 'Gravesmall', 'Asmall',
+	'Bsmall', 'Csmall', 'Dsmall', 'Esmall', 'Fsmall', 'Gsmall', 'Hsmall', 'Ismall',
+	'Jsmall', 'Ksmall', 'Lsmall', 'Msmall', 'Nsmall', 'Osmall', 'Psmall', 'Qsmall',
+	'Rsmall', 'Ssmall', 'Tsmall', 'Usmall', 'Vsmall', 'Wsmall', 'Xsmall', 'Ysmall',
+	'Zsmall', 'colonmonetary', 'onefitted', 'rupiah', 'Tildesmall', 'exclamdownsmall',
+	'centoldstyle', 'Lslashsmall', 'Scaronsmall', 'Zcaronsmall', 'Dieresissmall',
+	'Brevesmall', 'Caronsmall', 'Dotaccentsmall', 'Macronsmall', 'figuredash',
+	'hypheninferior', 'Ogoneksmall', 'Ringsmall', 'Cedillasmall', 'questiondownsmall',
+	'oneeighth', 'threeeighths', 'fiveeighths', 'seveneighths', 'onethird', 'twothirds',
+	'zerosuperior', 'foursuperior', 'fivesuperior', 'sixsuperior', 'sevensuperior',
+	'eightsuperior', 'ninesuperior', 'zeroinferior', 'oneinferior', 'twoinferior',
+	'threeinferior', 'fourinferior', 'fiveinferior', 'sixinferior', 'seveninferior',
+	'eightinferior', 'nineinferior', 'centinferior', 'dollarinferior', 'periodinferior',
+	'commainferior', 'Agravesmall', 'Aacutesmall', 'Acircumflexsmall', 'Atildesmall',
+	'Adieresissmall', 'Aringsmall', 'AEsmall', 'Ccedillasmall', 'Egravesmall',
+	'Eacutesmall', 'Ecircumflexsmall', 'Edieresissmall', 'Igravesmall', 'Iacutesmall',
+	'Icircumflexsmall', 'Idieresissmall', 'Ethsmall', 'Ntildesmall', 'Ogravesmall',
+	'Oacutesmall', 'Ocircumflexsmall', 'Otildesmall', 'Odieresissmall', 'OEsmall',
+	'Oslashsmall', 'Ugravesmall', 'Uacutesmall', 'Ucircumflexsmall', 'Udieresissmall',
+	'Yacutesmall', 'Thornsmall', 'Ydieresissmall', '001.000', '001.001', '001.002',
+	'001.003', 'Black', 'Bold', 'Book', 'Light', 'Medium', 'Regular', 'Roman',
+	'Semibold'
+]
+
+cff_expert_charset = [
+	0, 1, 229, 230, 231, 232, 233, 234, 235, 236, 237, 238, 13, 14, 15, 99, 239, 240,
+	241, 242, 243, 244, 245, 246, 247, 248, 27, 28, 249, 250, 251, 252, 253, 254, 255,
+	256, 257, 258, 259, 260, 261, 262, 263, 264, 265, 266, 109, 110, 267, 268, 269, 270,
+	271, 272, 273, 274, 275, 276, 277, 278, 279, 280, 281, 282, 283, 284, 285, 286, 287,
+	288, 289, 290, 291, 292, 293, 294, 295, 296, 297, 298, 299, 300, 301, 302, 303, 304,
+	305, 306, 307, 308, 309, 310, 311, 312, 313, 314, 315, 316, 317, 318, 158, 155, 163,
+	319, 320, 321, 322, 323, 324, 325, 326, 150, 164, 169, 327, 328, 329, 330, 331, 332,
+	333, 334, 335, 336, 337, 338, 339, 340, 341, 342, 343, 344, 345, 346, 347, 348, 349,
+	350, 351, 352, 353, 354, 355, 356, 357, 358, 359, 360, 361, 362, 363, 364, 365, 366,
+	367, 368, 369, 370, 371, 372, 373, 374, 375, 376, 377, 378
+]
+
+cff_expert_subset_charset = [
+	0, 1, 231, 232, 235, 236, 237, 238, 13, 14, 15, 99, 239, 240, 241, 242, 243, 244,
+	245, 246, 247, 248, 27, 28, 249, 250, 251, 253, 254, 255, 256, 257, 258, 259, 260,
+	261, 262, 263, 264, 265, 266, 109, 110, 267, 268, 269, 270, 272, 300, 301, 302, 305,
+	314, 315, 158, 155, 163, 320, 321, 322, 323, 324, 325, 326, 150, 164, 169, 327, 328,
+	329, 330, 331, 332, 333, 334, 335, 336, 337, 338, 339, 340, 341, 342, 343, 344, 345,
+	346
+]
+
+class Sfnt:
+	def __init__(self, data):
+		self.data = data
+		self.tables = {}
+		num_tables = self.uint16(4)
+		for i in range(num_tables):
+			tag, _, offset, length = struct.unpack_from('>4sIII', data, 12 + 16 * i)
+			self.tables[tag.decode('latin-1').strip()] = offset
+
+	def uint16(self, pos):
+		return struct.unpack_from('>H', self.data, pos)[0]
+
+	def int16(self, pos):
+		return struct.unpack_from('>h', self.data, pos)[0]
+
+	def uint32(self, pos):
+		return struct.unpack_from('>I', self.data, pos)[0]
+
+	def uint16s(self, pos, n):
+		return struct.unpack_from('>%dH' % n, self.data, pos)
+
+	# Offsets relative to base, as absolute positions.
+	def offsets(self, base, pos, n):
+		return [base + offset for offset in self.uint16s(pos, n)]
+
+	def glyph_ids(self, pos, n):
+		return self.uint16s(pos, n)
+
+# Map the file, and give the decoder the sfnt.
+def with_sfnt(filename, decode):
+	with open(filename, 'rb') as f:
+		mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	try:
+		with memoryview(mm) as data:
+			return decode(Sfnt(data))
+	finally:
+		mm.close()
+
+# Items of a CFF INDEX as (start, end) positions, and the position after it.
+def read_cff_index(sfnt, pos):
+	count = sfnt.uint16(pos)
+	if count == 0:
+		return [], pos + 2
+	off_size = sfnt.data[pos + 2]
+	offsets = []
+	for i in range(count + 1):
+		at = pos + 3 + off_size * i
+		offsets.append(int.from_bytes(sfnt.data[at:at + off_size], 'big'))
+	base = pos + 2 + off_size * (count + 1)
+	return [(base + offsets[i], base + offsets[i + 1]) for i in range(count)], \
+		base + offsets[count]
+
+# Operands of a CFF DICT by operator; escaped operators as 1200 + b1.
+def read_cff_dict(sfnt, start, end):
+	entries = {}
+	operands = []
+	pos = start
+	while pos < end:
+		b0 = sfnt.data[pos]
+		if b0 <= 21:
+			op = b0
+			if b0 == 12:
+				op = 1200 + sfnt.data[pos + 1]
+				pos += 1
+			entries[op] = operands
+			operands = []
+			pos += 1
+		elif b0 == 28:
+			operands.append(sfnt.int16(pos + 1))
+			pos += 3
+		elif b0 == 29:
+			operands.append(struct.unpack_from('>i', sfnt.data, pos + 1)[0])
+			pos += 5
+		elif b0 == 30:
+			# Reals are not needed here, and only skipped.
+			pos += 1
+			while sfnt.data[pos] & 0x0F != 0x0F and sfnt.data[pos] >> 4 != 0x0F:
+				pos += 1
+			operands.append(None)
+			pos += 1
+		elif b0 <= 246:
+			operands.append(b0 - 139)
+			pos += 1
+		elif b0 <= 250:
+			operands.append((b0 - 247) * 256 + sfnt.data[pos + 1] + 108)
+			pos += 2
+		else:
+			operands.append(-(b0 - 251) * 256 - sfnt.data[pos + 1] - 108)
+			pos += 2
+	return entries
+
+# Glyph names from the charset of the first font of a CFF table, as given by
+# ttx: SIDs through the standard and the custom strings, or CIDs as
+# cid00001 in CID-keyed fonts. Duplicates get suffixes .1, .2 and so on.
+def read_cff_glyph_names(sfnt):
+	cff = sfnt.tables['CFF']
+	_, top_dicts_pos = read_cff_index(sfnt, cff + sfnt.data[cff + 2])
+	top_dicts, strings_pos = read_cff_index(sfnt, top_dicts_pos)
+	strings, _ = read_cff_index(sfnt, strings_pos)
+	top = read_cff_dict(sfnt, *top_dicts[0])
+	char_strings, _ = read_cff_index(sfnt, cff + top[17][0])
+	n_glyphs = len(char_strings)
+	def name(sid):
+		if sid < len(cff_standard_strings):
+			return cff_standard_strings[sid]
+		start, end = strings[sid - len(cff_standard_strings)]
+		return bytes(sfnt.data[start:end]).decode('latin-1')
+	is_cid = 1230 in top
+	charset = top.get(15, [0])[0]
+	if charset == 0:
+		ids = range(min(n_glyphs, 229))
+	elif charset == 1:
+		ids = cff_expert_charset[:n_glyphs]
+	elif charset == 2:
+		ids = cff_expert_subset_charset[:n_glyphs]
+	else:
+		pos = cff + charset
+		form = sfnt.data[pos]
+		pos += 1
+		ids = [0]
+		if form == 0:
+			ids.extend(sfnt.uint16s(pos, n_glyphs - 1))
+		else:
+			while len(ids) < n_glyphs:
+				first = sfnt.uint16(pos)
+				if form == 1:
+					n_left = sfnt.data[pos + 2]
+					pos += 3
+				else:
+					n_left = sfnt.uint16(pos + 2)
+					pos += 4
+				ids.extend(range(first, first + n_left + 1))
+	names = ['.notdef'] + ['cid%.5d' % i if is_cid else name(i) for i in ids[1:]]
+	counts = {}
+	unique = []
+	for glyph in names:
+		if glyph in counts:
+			n = counts[glyph]
+			while glyph + '.' + str(n) in counts or glyph + '.' + str(n) in names:
+				n += 1
+			counts[glyph] = n + 1
+			glyph = glyph + '.' + str(n)
+		counts[glyph] = 1
+		unique.append(glyph)
+	return unique
+
+# As in ttx, names in the CFF charset take precedence over those in post.
+def read_glyph_names(sfnt):
+	n_glyphs = sfnt.uint16(sfnt.tables['maxp'] + 4)
+	names = []
+	if 'CFF' in sfnt.tables:
+		names = read_cff_glyph_names(sfnt)
+	elif 'post' in sfnt.tables:
+		post = sfnt.tables['post']
+		form = sfnt.uint32(post)
+		if form == 0x00010000:
+			names = standard_mac_names[:n_glyphs]
+		elif form == 0x00020000:
+			n_indexes = sfnt.uint16(post + 32)
+			indexes = sfnt.uint16s(post + 34, n_indexes)
+			extra = []
+			pos = post + 34 + 2 * n_indexes
+			while len(extra) <= max(indexes, default=0) - 258:
+				length = sfnt.data[pos]
+				extra.append(bytes(sfnt.data[pos+1:pos+1+length]).decode('latin-1'))
+				pos += 1 + length
+			names = [standard_mac_names[i] if i < 258 else extra[i - 258] for i in indexes]
+	# Glyphs without names in post, and duplicates, named as by ttx.
+	glyphs = []
+	seen = set()
+	for gid in range(n_glyphs):
+		name = names[gid] if gid < len(names) else 'glyph%.5d' % gid
+		if gid == 0 and name != '.notdef':
+			name = '.notdef'
+		if name in seen:
+			n = 1
+			while name + '#' + str(n) in seen:
+				n += 1
+			name = name + '#' + str(n)
+		seen.add(name)
+		glyphs.append(name)
+	return glyphs
+
+def read_cmap4(sfnt, pos, glyphs, charset):
+	seg_count = sfnt.uint16(pos + 6) // 2
+	ends = sfnt.uint16s(pos + 14, seg_count)
+	starts = sfnt.uint16s(pos + 16 + 2 * seg_count, seg_count)
+	deltas = struct.unpack_from('>%dh' % seg_count, sfnt.data, pos + 16 + 4 * seg_count)
+	range_pos = pos + 16 + 6 * seg_count
+	range_offsets = sfnt.uint16s(range_pos, seg_count)
+	# The last segment, for 0xFFFF, is not used.
+	for i in range(seg_count - 1):
+		for code in range(starts[i], ends[i] + 1):
+			if range_offsets[i] == 0:
+				gid = (code + deltas[i]) & 0xFFFF
+			else:
+				gid = sfnt.uint16(range_pos + 2 * i + range_offsets[i] + 2 * (code - starts[i]))
+				if gid != 0:
+					gid = (gid + deltas[i]) & 0xFFFF
+			if gid != 0:
+				charset[code] = glyphs[gid]
+
+def read_cmap6(sfnt, pos, glyphs, charset):
+	first, count = sfnt.uint16s(pos + 6, 2)
+	for i, gid in enumerate(sfnt.glyph_ids(pos + 10, count)):
+		if gid != 0:
+			charset[first + i] = glyphs[gid]
+
+def read_cmap12(sfnt, pos, glyphs, charset):
+	n_groups = sfnt.uint32(pos + 12)
+	for i in range(n_groups):
+		start, end, start_gid = struct.unpack_from('>III', sfnt.data, pos + 16 + 12 * i)
+		for code in range(start, end + 1):
+			gid = start_gid + code - start
+			if gid != 0:
+				charset[code] = glyphs[gid]
+
+def uint24(sfnt, pos):
+	return (sfnt.data[pos] << 16) | sfnt.uint16(pos + 1)
+
+def read_cmap14(sfnt, pos, glyphs, font):
+	n_records = sfnt.uint32(pos + 6)
+	for i in range(n_records):
+		rec = pos + 10 + 11 * i
+		uvs = uint24(sfnt, rec)
+		default_offset = sfnt.uint32(rec + 3)
+		non_default_offset = sfnt.uint32(rec + 7)
+		if default_offset:
+			ranges = pos + default_offset
+			for j in range(sfnt.uint32(ranges)):
+				start = uint24(sfnt, ranges + 4 + 4 * j)
+				for uv in range(start, start + sfnt.data[ranges + 7 + 4 * j] + 1):
+					font.vs_to_name[(uv, uvs)] = None
+		if non_default_offset:
+			mappings = pos + non_default_offset
+			for j in range(sfnt.uint32(mappings)):
+				uv = uint24(sfnt, mappings + 4 + 5 * j)
+				font.vs_to_name[(uv, uvs)] = glyphs[sfnt.uint16(mappings + 7 + 5 * j)]
+
+# As read_table in ttxread: first format 4 and 12 subtables for platform 0,
+# first format 6 and 14 subtables.
+def read_cmap(sfnt, glyphs, font):
+	cmap = sfnt.tables['cmap']
+	found = set()
+	for i in range(sfnt.uint16(cmap + 2)):
+		platform, _, offset = struct.unpack_from('>HHI', sfnt.data, cmap + 4 + 8 * i)
+		pos = cmap + offset
+		form = sfnt.uint16(pos)
+		if form == 4 and platform == 0 and form not in found:
+			read_cmap4(sfnt, pos, glyphs, font.charset_large)
+		elif form == 6 and form not in found:
+			read_cmap6(sfnt, pos, glyphs, font.charset_small)
+		elif form == 12 and platform == 0 and form not in found:
+			read_cmap12(sfnt, pos, glyphs, font.charset_total)
+		elif form == 14 and form not in found:
+			read_cmap14(sfnt, pos, glyphs, font)
+		else:
+			continue
+		found.add(form)
+
+def read_hmtx(sfnt, glyphs, font):
+	n_metrics = sfnt.uint16(sfnt.tables['hhea'] + 34)
+	hmtx = sfnt.tables['hmtx']
+	for gid, name in enumerate(glyphs):
+		if gid < n_metrics:
+			font.width[name] = sfnt.uint16(hmtx + 4 * gid)
+			font.lsb[name] = sfnt.int16(hmtx + 4 * gid + 2)
+		else:
+			font.width[name] = sfnt.uint16(hmtx + 4 * (n_metrics - 1))
+			font.lsb[name] = sfnt.int16(hmtx + 4 * n_metrics + 2 * (gid - n_metrics))
+
+def read_coverage_ids(sfnt, pos):
+	form, count = sfnt.uint16s(pos, 2)
+	if form == 1:
+		return list(sfnt.glyph_ids(pos + 4, count))
+	covered = []
+	for i in range(count):
+		start, end, _ = sfnt.uint16s(pos + 4 + 6 * i, 3)
+		covered.extend(range(start, end + 1))
+	return covered
+
+def read_coverage(sfnt, pos, glyphs):
+	return [glyphs[gid] for gid in read_coverage_ids(sfnt, pos)]
+
+def read_class_def(sfnt, pos, glyphs):
+	classes = {}
+	form = sfnt.uint16(pos)
+	if form == 1:
+		start, count = sfnt.uint16s(pos + 2, 2)
+		for i, cl in enumerate(sfnt.uint16s(pos + 6, count)):
+			if cl != 0:
+				classes[glyphs[start + i]] = cl
+	else:
+		for i in range(sfnt.uint16(pos + 2)):
+			start, end, cl = sfnt.uint16s(pos + 4 + 6 * i, 3)
+			if cl != 0:
+				for gid in range(start, end + 1):
+					classes[glyphs[gid]] = cl
+	return classes
+
+def read_GDEF(sfnt, glyphs, font):
+	gdef = sfnt.tables['GDEF']
+	minor = sfnt.uint16(gdef + 2)
+	class_def, _, _, mark_class_def = sfnt.uint16s(gdef + 4, 4)
+	if class_def:
+		font.glyph_to_class.update(read_class_def(sfnt, gdef + class_def, glyphs))
+	if mark_class_def:
+		font.mark_to_class.update(read_class_def(sfnt, gdef + mark_class_def, glyphs))
+	if minor >= 2 and sfnt.uint16(gdef + 12):
+		sets = gdef + sfnt.uint16(gdef + 12)
+		for index in range(sfnt.uint16(sets + 2)):
+			coverage = sets + sfnt.uint32(sets + 4 + 4 * index)
+			font.index_to_glyphs[index] = read_coverage(sfnt, coverage, glyphs)
+
+def read_feature(sfnt, features, index):
+	tag = bytes(sfnt.data[features + 2 + 6 * index:features + 6 + 6 * index]).decode('latin-1')
+	feature_pos = features + sfnt.uint16(features + 6 + 6 * index)
+	feature = Feature(tag)
+	count = sfnt.uint16(feature_pos + 2)
+	for lookup_index in sfnt.uint16s(feature_pos + 4, count):
+		feature.add_lookup_index(lookup_index)
+	return feature
+
+def first_script_tag(sfnt, scripts):
+	if sfnt.uint16(scripts) == 0:
+		return None
+	return bytes(sfnt.data[scripts + 2:scripts + 6]).decode('latin-1')
+
+# Feature indexes of language systems, in the order in which ttx lists them.
+def language_feature_indexes(sfnt, scripts):
+	indexes = []
+	def lang_sys(pos):
+		count = sfnt.uint16(pos + 4)
+		indexes.extend(sfnt.uint16s(pos + 6, count))
+	for i in range(sfnt.uint16(scripts)):
+		script = scripts + sfnt.uint16(scripts + 6 + 6 * i)
+		default, count = sfnt.uint16s(script, 2)
+		if default:
+			lang_sys(script + default)
+		for j in range(count):
+			lang_sys(script + sfnt.uint16(script + 8 + 6 * j))
+	return indexes
+
+# Subtables of a lookup as (type, position), resolving extensions.
+def lookup_subtables(sfnt, pos, extension_type):
+	typ, flag, count = sfnt.uint16s(pos, 3)
+	subtables = []
+	for subtable in sfnt.offsets(pos, pos + 6, count):
+		if typ == extension_type:
+			subtables.append((sfnt.uint16(subtable + 2), subtable + sfnt.uint32(subtable + 4)))
+		else:
+			subtables.append((typ, subtable))
+	filter_set = sfnt.uint16(pos + 6 + 2 * count) if flag & 16 else None
+	return typ, flag, filter_set, subtables
+
+def read_coverages(sfnt, pos, base, glyphs):
+	count = sfnt.uint16(pos)
+	coverages = [read_coverage(sfnt, cov, glyphs) for cov in sfnt.offsets(base, pos + 2, count)]
+	return coverages, pos + 2 + 2 * count
+
+def read_lookup_records(sfnt, pos):
+	count = sfnt.uint16(pos)
+	records = sfnt.uint16s(pos + 2, 2 * count)
+	return list(zip(records[0::2], records[1::2]))
+
+# The backtrack is stored from the glyph before the input backward, and
+# returned in buffer order.
+def read_chain_context3(sfnt, pos, glyphs):
+	lefts, next_pos = read_coverages(sfnt, pos + 2, pos, glyphs)
+	inputs, next_pos = read_coverages(sfnt, next_pos, pos, glyphs)
+	rights, next_pos = read_coverages(sfnt, next_pos, pos, glyphs)
+	return lefts[::-1], inputs, rights, read_lookup_records(sfnt, next_pos)
+
+# Glyph ids or classes of a rule of Format 1 or 2, without the first input.
+def read_chain_rule(sfnt, pos):
+	count = sfnt.uint16(pos)
+	lefts = list(sfnt.uint16s(pos + 2, count))
+	pos += 2 + 2 * count
+	count = sfnt.uint16(pos)
+	inputs = list(sfnt.uint16s(pos + 2, count - 1))
+	pos += 2 * count
+	count = sfnt.uint16(pos)
+	rights = list(sfnt.uint16s(pos + 2, count))
+	pos += 2 + 2 * count
+	return lefts[::-1], inputs, rights, read_lookup_records(sfnt, pos)
+
+# Rules of the rule sets of a Format 1 or 2 subtable at pos, whose count
+# and offsets are at sets_pos. Sets may be missing.
+def read_chain_rule_sets(sfnt, pos, sets_pos):
+	rule_sets = []
+	for offset in sfnt.uint16s(sets_pos + 2, sfnt.uint16(sets_pos)):
+		rules = []
+		if offset:
+			rule_set = pos + offset
+			for rule in sfnt.offsets(rule_set, rule_set + 2, sfnt.uint16(rule_set)):
+				rules.append(read_chain_rule(sfnt, rule))
+		rule_sets.append(rules)
+	return rule_sets
+
+# Rules in the order of the TTX dump, which sorts on glyph names.
+def read_subst(sfnt, typ, pos, glyphs, lookup):
+	form = sfnt.uint16(pos)
+	if typ == 1:
+		input_ids = read_coverage_ids(sfnt, pos + sfnt.uint16(pos + 2))
+		inputs = [glyphs[gid] for gid in input_ids]
+		if form == 1:
+			delta = sfnt.int16(pos + 4)
+			outputs = [glyphs[(gid + delta) & 0xFFFF] for gid in input_ids]
+		else:
+			count = sfnt.uint16(pos + 4)
+			outputs = [glyphs[gid] for gid in sfnt.glyph_ids(pos + 6, count)]
+		for input, output in sorted(zip(inputs, outputs)):
+			lookup.add(SingleSubstitution1(input, output))
+	elif typ == 2:
+		inputs = read_coverage(sfnt, pos + sfnt.uint16(pos + 2), glyphs)
+		count = sfnt.uint16(pos + 4)
+		sequences = []
+		for seq in sfnt.offsets(pos, pos + 6, count):
+			n = sfnt.uint16(seq)
+			sequences.append([glyphs[gid] for gid in sfnt.glyph_ids(seq + 2, n)])
+		for input, outputs in sorted(zip(inputs, sequences)):
+			lookup.add(MultSubstitution(input, outputs))
+	elif typ == 4:
+		firsts = read_coverage(sfnt, pos + sfnt.uint16(pos + 2), glyphs)
+		count = sfnt.uint16(pos + 4)
+		lig_sets = sfnt.offsets(pos, pos + 6, count)
+		for first, lig_set in sorted(zip(firsts, lig_sets)):
+			n = sfnt.uint16(lig_set)
+			for lig in sfnt.offsets(lig_set, lig_set + 2, n):
+				output, n_comps = sfnt.uint16s(lig, 2)
+				comps = [glyphs[gid] for gid in sfnt.glyph_ids(lig + 4, n_comps - 1)]
+				lookup.add(LigSubstitution([first] + comps, glyphs[output]))
+	elif typ == 6 and form == 1:
+		firsts = read_coverage(sfnt, pos + sfnt.uint16(pos + 2), glyphs)
+		for first, rules in zip(firsts, read_chain_rule_sets(sfnt, pos, pos + 4)):
+			for lefts, inputs, rights, refs in rules:
+				lookup.add(ChainSubstitution3([glyphs[gid] for gid in lefts], \
+					[first] + [glyphs[gid] for gid in inputs], [glyphs[gid] for gid in rights], refs))
+	elif typ == 6 and form == 2:
+		coverage = read_coverage(sfnt, pos + sfnt.uint16(pos + 2), glyphs)
+		class_defs = [read_class_def(sfnt, pos + offset, glyphs) if offset else {} \
+			for offset in sfnt.uint16s(pos + 4, 3)]
+		rule_sets = [[ChainClassRule(lefts, [cl] + inputs, rights, refs) \
+			for lefts, inputs, rights, refs in rules] \
+				for cl, rules in enumerate(read_chain_rule_sets(sfnt, pos, pos + 10))]
+		lookup.add(ChainSubstitution2(coverage, *class_defs, rule_sets))
+	elif typ == 6 and form == 3:
+		lefts, inputs, rights, refs = read_chain_context3(sfnt, pos, glyphs)
+		lookup.add(ChainSubstitution3(lefts, inputs, rights, refs))
+	elif typ == 8:
+		inputs = [read_coverage(sfnt, pos + sfnt.uint16(pos + 2), glyphs)]
+		lefts, next_pos = read_coverages(sfnt, pos + 4, pos, glyphs)
+		rights, next_pos = read_coverages(sfnt, next_pos, pos, glyphs)
+		count = sfnt.uint16(next_pos)
+		outputs = [glyphs[gid] for gid in sfnt.glyph_ids(next_pos + 2, count)]
+		lookup.add(ReverseSubstitution(lefts, inputs, rights, outputs))
+	else:
+		print('Unexpected GSUB subtable', typ, form)
+
+def read_GSUB(sfnt, glyphs, font):
+	gsub = sfnt.tables['GSUB']
+	scripts, features, lookups = sfnt.offsets(gsub, gsub + 4, 3)
+	script = first_script_tag(sfnt, scripts)
+	if script is not None:
+		font.script = script
+	for index in range(sfnt.uint16(features)):
+		font.add_GSUB_feature(read_feature(sfnt, features, index))
+	for index, pos in enumerate(sfnt.offsets(lookups, lookups + 2, sfnt.uint16(lookups))):
+		typ_value, flag, filter_set, subtables = lookup_subtables(sfnt, pos, 7)
+		typ = '7/' + str(subtables[0][0]) if typ_value == 7 and subtables else '1'
+		chain_formats = [sfnt.uint16(sub) for t, sub in subtables if t == 6]
+		if chain_formats:
+			typ += '.' + str(chain_formats[0])
+		lookup = GSUB_Lookup(index, typ)
+		set_flag(flag, lookup)
+		lookup.filter_set = filter_set
+		for t, sub in subtables:
+			read_subst(sfnt, t, sub, glyphs, lookup)
+		font.add_GSUB_lookup(index, lookup)
+
+def read_anchor(sfnt, pos):
+	return {'x': sfnt.int16(pos + 2), 'y': sfnt.int16(pos + 4)}
+
+def read_marks(sfnt, pos):
+	marks = []
+	for i in range(sfnt.uint16(pos)):
+		cl, anchor = sfnt.uint16s(pos + 2 + 4 * i, 2)
+		coords = read_anchor(sfnt, pos + anchor)
+		marks.append({'class': cl, 'x': coords['x'], 'y': coords['y']})
+	return marks
+
+def read_anchor_records(sfnt, pos, n_classes):
+	records = []
+	for i in range(sfnt.uint16(pos)):
+		anchors = sfnt.uint16s(pos + 2 + 2 * n_classes * i, n_classes)
+		records.append({cl: read_anchor(sfnt, pos + anchor) \
+			for cl, anchor in enumerate(anchors) if anchor != 0})
+	return records
+
+def read_attachment(sfnt, pos, glyphs):
+	covs = sfnt.offsets(pos, pos + 2, 2)
+	n_classes = sfnt.uint16(pos + 6)
+	arrays = sfnt.offsets(pos, pos + 8, 2)
+	marks = [{'glyph': g, **mark} for g, mark in \
+		zip(read_coverage(sfnt, covs[0], glyphs), read_marks(sfnt, arrays[0]))]
+	others = [{'glyph': g, 'coordinates': coords} for g, coords in \
+		zip(read_coverage(sfnt, covs[1], glyphs), read_anchor_records(sfnt, arrays[1], n_classes))]
+	return marks, others
+
+def value_record(sfnt, pos, form):
+	values = {}
+	for bit, field in enumerate(['XPlacement', 'YPlacement', 'XAdvance', 'YAdvance', \
+			'XPlaDevice', 'YPlaDevice', 'XAdvDevice', 'YAdvDevice']):
+		if form & (1 << bit):
+			values[field] = sfnt.int16(pos)
+			pos += 2
+	return values, pos
+
+def placement(values):
+	return {field: values[field] for field in ['XPlacement', 'YPlacement'] if field in values}
+
+def read_pair_pos(sfnt, pos, glyphs):
+	form, coverage, value_form1, value_form2 = sfnt.uint16s(pos, 4)
+	covered = read_coverage(sfnt, pos + coverage, glyphs)
+	second_values = value_form2 != 0
+	if form == 1:
+		firsts = []
+		seconds = []
+		records = []
+		for first, pair_set in zip(covered, sfnt.offsets(pos, pos + 10, sfnt.uint16(pos + 8))):
+			record_pos = pair_set + 2
+			for i in range(sfnt.uint16(pair_set)):
+				firsts.append(first)
+				seconds.append(glyphs[sfnt.uint16(record_pos)])
+				value1, record_pos = value_record(sfnt, record_pos + 2, value_form1)
+				value2, record_pos = value_record(sfnt, record_pos, value_form2)
+				records.append((value1, value2))
+		values1 = new_values(len(records))
+		values2 = new_values(len(records)) if second_values else None
+		for index, (value1, value2) in enumerate(records):
+			set_value(values1, index, value1)
+			if second_values:
+				set_value(values2, index, value2)
+		return PairAdjustment1(firsts, seconds, values1, values2)
+	class_def1, class_def2, n_classes1, n_classes2 = sfnt.uint16s(pos + 8, 4)
+	values1 = new_values((n_classes1, n_classes2))
+	values2 = new_values((n_classes1, n_classes2)) if second_values else None
+	record_pos = pos + 16
+	for cl1 in range(n_classes1):
+		for cl2 in range(n_classes2):
+			value1, record_pos = value_record(sfnt, record_pos, value_form1)
+			value2, record_pos = value_record(sfnt, record_pos, value_form2)
+			set_value(values1, (cl1, cl2), value1)
+			if second_values:
+				set_value(values2, (cl1, cl2), value2)
+	return PairAdjustment2(covered, read_class_def(sfnt, pos + class_def1, glyphs), \
+		read_class_def(sfnt, pos + class_def2, glyphs), values1, values2)
+
+def read_pos(sfnt, typ, pos, glyphs, lookup):
+	form = sfnt.uint16(pos)
+	if typ == 1:
+		covered = read_coverage(sfnt, pos + sfnt.uint16(pos + 2), glyphs)
+		value_form = sfnt.uint16(pos + 4)
+		if form == 1:
+			values, _ = value_record(sfnt, pos + 6, value_form)
+			adjustments = [placement(values)] * len(covered)
+		else:
+			adjustments = []
+			value_pos = pos + 8
+			for i in range(sfnt.uint16(pos + 6)):
+				values, value_pos = value_record(sfnt, value_pos, value_form)
+				adjustments.append(placement(values))
+		adjs = [{'glyph': g, 'placement': a} for (g, a) in zip(covered, adjustments)]
+		lookup.add_positioning(SingleAdjustment(str(value_form), adjs))
+	elif typ == 2:
+		lookup.add_positioning(read_pair_pos(sfnt, pos, glyphs))
+	elif typ == 4:
+		marks, bases = read_attachment(sfnt, pos, glyphs)
+		lookup.add_positioning(MarkBaseAttachment(marks, bases))
+	elif typ == 6:
+		marks1, marks2 = read_attachment(sfnt, pos, glyphs)
+		lookup.add_positioning(MarkMarkAttachment(marks1, marks2))
+	elif typ == 8 and form == 3:
+		lefts, inputs, rights, refs = read_chain_context3(sfnt, pos, glyphs)
+		input = inputs[-1] if inputs else []
+		output = refs[-1][1] if refs else None
+		lookup.add_positioning(ChainPos(lefts, input, rights, output))
+	else:
+		print('Unexpected GPOS subtable', typ, form)
+
+def read_GPOS(sfnt, glyphs, font):
+	gpos = sfnt.tables['GPOS']
+	scripts, features, lookups = sfnt.offsets(gpos, gpos + 4, 3)
+	for index in language_feature_indexes(sfnt, scripts):
+		font.add_GPOS_feature(read_feature(sfnt, features, index))
+	for index, pos in enumerate(sfnt.offsets(lookups, lookups + 2, sfnt.uint16(lookups))):
+		typ_value, flag, filter_set, subtables = lookup_subtables(sfnt, pos, 9)
+		if typ_value == 9 and subtables:
+			typ = '9/' + str(subtables[0][0])
+		else:
+			typ = str(typ_value)
+		lookup = GPOS_Lookup(index, typ)
+		set_flag(flag, lookup)
+		lookup.filter_set = filter_set
+		for t, sub in subtables:
+			read_pos(sfnt, t, sub, glyphs, lookup)
+		font.add_GPOS_lookup(index, lookup)
+
+binary_readers = {'GDEF': read_GDEF, 'GSUB': read_GSUB, 'GPOS': read_GPOS}
+
+# GDEF, GSUB and GPOS, decoded when first used.
+class BinaryTables(LazyTables):
+	def __init__(self, filename, glyphs, tables):
+		LazyTables.__init__(self, filename, tables)
+		self.glyphs = glyphs
+
+	def read(self, font, tables):
+		def decode(sfnt):
+			for table in tables:
+				binary_readers[table](sfnt, self.glyphs, font)
+		with_sfnt(self.filename, decode)
+
+# Font from a binary .otf or .ttf file, without a TTX dump. Only the
+# glyph order, cmap, hmtx, GDEF, GSUB and GPOS are read, the last three
+# lazily. Glyph names come from the CFF charset or the post table, and
+# otherwise are of the form glyph00001.
+def read_otf(filename, intern=False):
+	font = Font()
+	def decode(sfnt):
+		font.glyphs = read_glyph_names(sfnt)
+		read_cmap(sfnt, font.glyphs, font)
+		read_hmtx(sfnt, font.glyphs, font)
+		return [table for table in binary_readers if table in sfnt.tables]
+	lazy = with_sfnt(filename, decode)
+	for table in lazy:
+		for attr in table_attributes[table]:
+			delattr(font, attr)
+	font.lazy_tables = BinaryTables(filename, font.glyphs, lazy)
+	if intern:
+		font.intern_glyphs()
+	return font
@@ -0,0 +1,80 @@
+import hashlib
+import os
+import pickle
+
+from ttxread import read_ttx
+
+# Snapshots written with another version are ignored. Increase whenever
+# Font, its lookups or their compiled forms change.
+CACHE_VERSION = 13
+
+MAGIC = b'TTXFONT\n'
+
+def file_hash(filename):
+	h = hashlib.sha256()
+	with open(filename, 'rb') as f:
+		for chunk in iter(lambda: f.read(1 << 20), b''):
+			h.update(chunk)
+	return h.hexdigest()
+
+def snapshot_filename(filename, cache_dir, intern):
+	path = os.path.abspath(filename) + ('#intern' if intern else '')
+	key = hashlib.sha256(path.encode('utf-8')).hexdigest()[:16]
+	return os.path.join(cache_dir, os.path.basename(filename) + '.' + key + '.snapshot')
+
+# The header is read on its own, so that an outdated snapshot is
+# recognized without unpickling the font.
+def read_snapshot_header(f):
+	if f.read(len(MAGIC)) != MAGIC:
+		return None
+	return pickle.load(f)
+
+def write_snapshot(snapshot, header, font):
+	tmp = snapshot + '.' + str(os.getpid()) + '.tmp'
+	with open(tmp, 'wb') as f:
+		f.write(MAGIC)
+		pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+		pickle.dump(font, f, protocol=pickle.HIGHEST_PROTOCOL)
+	os.replace(tmp, snapshot)
+
+# The snapshot is valid if it has the current version and was made from a
+# file with the same size and content. If only the modification time
+# changed, the content hash decides, and the header is renewed.
+def read_snapshot(snapshot, filename, stat):
+	try:
+		with open(snapshot, 'rb') as f:
+			header = read_snapshot_header(f)
+			if header is None or header['version'] != CACHE_VERSION or \
+					header['size'] != stat.st_size:
+				return None
+			if header['mtime'] != stat.st_mtime_ns:
+				if header['hash'] != file_hash(filename):
+					return None
+				renew = True
+			else:
+				renew = False
+			font = pickle.load(f)
+	except Exception:
+		return None
+	if renew:
+		header['mtime'] = stat.st_mtime_ns
+		write_snapshot(snapshot, header, font)
+	return font
+
+# As read_ttx, but the fully built and compiled font is stored in a
+# snapshot in cache_dir (by default __fontcache__ next to the file), which
+# later calls load instead of parsing the TTX file again.
+def read_ttx_cached(filename, cache_dir=None, intern=False):
+	if cache_dir is None:
+		cache_dir = os.path.join(os.path.dirname(os.path.abspath(filename)), '__fontcache__')
+	snapshot = snapshot_filename(filename, cache_dir, intern)
+	stat = os.stat(filename)
+	font = read_snapshot(snapshot, filename, stat)
+	if font is None:
+		font = read_ttx(filename, intern=intern)
+		font.compile()
+		header = {'version': CACHE_VERSION, 'size': stat.st_size, \
+			'mtime': stat.st_mtime_ns, 'hash': file_hash(filename)}
+		os.makedirs(cache_dir, exist_ok=True)
+		write_snapshot(snapshot, header, font)
+	return font
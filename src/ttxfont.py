@@ -1,55 +1,303 @@
 import os
+import bisect
+import itertools
+import multiprocessing
+import random
+from array import array
+from collections import deque, OrderedDict
+import numpy as np
 from lxml import etree
 from datetime import datetime
 
 from ttxtables import read_basic_properties, read_post
 
 def equiv(elem1, elem2):
-	if isinstance(elem1, list):
+	if isinstance(elem1, (list, frozenset)):
 		return elem2 in elem1
-	elif isinstance(elem2, list):
+	elif isinstance(elem2, (list, frozenset)):
 		return elem1 in elem2
 	else:
 		return elem1 == elem2
 
 def equiv_list(l1, l2):
-	return all([equiv(pair[0], pair[1]) for pair in zip(l1, l2)])
+	return all(equiv(pair[0], pair[1]) for pair in zip(l1, l2))
 
-def is_suffix_of(l1, l2):
-	return len(l1) <= len(l2) and equiv_list(l1, l2[-len(l1):])
-	
 def is_prefix_of(l1, l2):
 	return len(l1) <= len(l2) and equiv_list(l1, l2[:len(l1)])
 
+def glyph_keys(font, glyphs):
+	if isinstance(glyphs, list):
+		return [glyph_keys(font, g) for g in glyphs]
+	else:
+		return font.glyph_key(glyphs)
+
+# Coverages become sets, for constant-time membership tests.
+def coverage_keys(font, coverage):
+	if isinstance(coverage, list):
+		return frozenset(glyph_keys(font, coverage))
+	else:
+		return font.glyph_key(coverage)
+
+def coverages_keys(font, coverages):
+	return [coverage_keys(font, coverage) for coverage in coverages]
+
+# ClassDef from glyph names to classes, as table by glyph key.
+def class_table(font, classes):
+	return font.glyph_table({font.glyph_key(g): cl for g, cl in classes.items()}, 0, 'H')
+
+# Table from glyph names to values, with default value for other glyphs.
+class GlyphTable(dict):
+	def __init__(self, default):
+		self.default = default
+
+	def __missing__(self, glyph):
+		return self.default
+
+# Digests of sets of glyphs, as in HarfBuzz: three masks of 64 bits, set by
+# bits of glyph indexes from three shifts, in one int. Sets of glyphs whose
+# digests have no bit in common in some mask are disjoint.
+DIGEST_MASK = (1 << 64) - 1
+ALL_GLYPHS_DIGEST = (1 << 192) - 1
+
+def glyph_digest(index):
+	return (1 << (index & 63)) | (1 << (64 + ((index >> 4) & 63))) | \
+		(1 << (128 + ((index >> 9) & 63)))
+
+def digests_overlap(digest1, digest2):
+	common = digest1 & digest2
+	return (common & DIGEST_MASK) != 0 and (common >> 64 & DIGEST_MASK) != 0 and \
+		(common >> 128) != 0
+
+def skips_glyph(lookup, glyph_class, mark_class, in_filter_set):
+	if lookup.ignore_base_glyphs and glyph_class == BASE_GLYPH:
+		return True
+	if lookup.ignore_ligatures and glyph_class == LIGATURE_GLYPH:
+		return True
+	if lookup.ignore_marks and glyph_class == MARK_GLYPH:
+		return True
+	if lookup.mark_class != 0 and mark_class != lookup.mark_class:
+		return True
+	if lookup.filter_set is not None and not in_filter_set:
+		return True
+	return False
+
+# Which glyphs a lookup skips, computed once for all glyphs. Glyphs without
+# GDEF class or mark attachment class count as having class 0.
+def skip_mask(font, lookup):
+	if lookup.filter_set is None:
+		filter_set = frozenset()
+	else:
+		filter_set = font.mark_sets.get(lookup.filter_set, frozenset())
+	default = skips_glyph(lookup, 0, 0, False)
+	skips_by_classes = {}
+	skips = {}
+	for glyph in font.classified_glyphs.union(filter_set):
+		classes = (font.class_of[glyph], font.mark_class_of[glyph], glyph in filter_set)
+		if classes not in skips_by_classes:
+			skips_by_classes[classes] = skips_glyph(lookup, *classes)
+		if skips_by_classes[classes] != default:
+			skips[glyph] = skips_by_classes[classes]
+	return font.glyph_table(skips, default)
+
 def filter_glyph(glyph, font, lookup):
-	if lookup.ignore_base_glyphs and font.glyph_to_class[glyph] == BASE_GLYPH:
-		return False
-	if lookup.ignore_ligatures and font.glyph_to_class[glyph] == LIGATURE_GLYPH:
-		return False
-	if lookup.ignore_marks and font.glyph_to_class[glyph] == MARK_GLYPH:
-		return False
-	if lookup.mark_class != 0 and \
-			(glyph not in font.mark_to_class or \
-				font.mark_to_class[glyph] != lookup.mark_class):
-		return False
-	if lookup.filter_set is not None and glyph not in font.index_to_glyphs[lookup.filter_set]:
-		return False
-	return True
+	return not lookup.skip_mask[glyph]
 
 def filter_list(l, filter):
 	return [token for token in l if filter(token)]
 
-def first_filtered_left(l, filter):
-	for i in range(len(l)):
-		if filter(l[i]):
-			return i
-	return -1
+# Positions of the n glyphs after pos that the lookup does not skip, or fewer
+# at the end of the buffer. Only walks as far as needed.
+def skip_right(tokens, pos, n, lookup):
+	mask = lookup.skip_mask
+	posses = []
+	pos += 1
+	end = len(tokens)
+	while len(posses) < n and pos < end:
+		if not mask[tokens[pos]]:
+			posses.append(pos)
+		pos += 1
+	return posses
+
+# Positions of the n glyphs before pos that the lookup does not skip, in
+# buffer order.
+def skip_left(tokens, pos, n, lookup):
+	mask = lookup.skip_mask
+	posses = []
+	pos -= 1
+	while len(posses) < n and pos >= 0:
+		if not mask[tokens[pos]]:
+			posses.append(pos)
+		pos -= 1
+	return posses[::-1]
+
+def glyphs_at(tokens, posses):
+	return [tokens[p] for p in posses]
+
+# Whether there are as many posses as coverages, given as sets of classes,
+# and the glyph at each is in its coverage.
+def classes_match(coverages, tokens, posses, class_of):
+	if len(posses) != len(coverages):
+		return False
+	for classes, pos in zip(coverages, posses):
+		if class_of[tokens[pos]] not in classes:
+			return False
+	return True
 
-def first_filtered_right(l, filter):
-	for i in reversed(range(len(l))):
-		if filter(l[i]):
-			return i
-	return -1
+# Glyphs in coverages, which are single glyphs or sets of glyphs.
+def coverages_glyphs(coverages):
+	for coverage in coverages:
+		if isinstance(coverage, frozenset):
+			yield from coverage
+		else:
+			yield coverage
+
+# Glyphs in the coverages of the chaining rules of a lookup, grouped into
+# classes of glyphs that are in exactly the same coverages, much as in a
+# ClassDef. Glyphs in none are in class 0. Equal coverages are shared, and
+# each is also given as the set of its classes, so that matching maps a
+# glyph to its class once and looks it up in small sets of ints.
+class CoverageClasses:
+	def __init__(self, font, coverages):
+		self.shared = {}
+		signatures = {}
+		for coverage in coverages:
+			if coverage not in self.shared:
+				self.shared[coverage] = coverage
+				for glyph in coverages_glyphs([coverage]):
+					signatures.setdefault(glyph, []).append(coverage)
+		classes = {}
+		class_of = {}
+		members = {coverage: set() for coverage in self.shared}
+		for glyph, signature in signatures.items():
+			signature = tuple(signature)
+			if signature not in classes:
+				classes[signature] = len(classes) + 1
+				for coverage in signature:
+					members[coverage].add(classes[signature])
+			class_of[glyph] = classes[signature]
+		self.class_of = font.glyph_table(class_of, 0, 'H')
+		self.classes = {coverage: frozenset(members[coverage]) for coverage in self.shared}
+		self.n_coverages = len(coverages)
+		self.n_glyphs = len(signatures)
+		self.n_classes = len(classes)
+
+	def share(self, coverages):
+		return [self.shared[coverage] for coverage in coverages]
+
+	def classes_of(self, coverages):
+		return [self.classes[coverage] for coverage in coverages]
+
+	def stats(self):
+		return {'coverages': self.n_coverages, 'distinct_coverages': len(self.shared), \
+			'glyphs': self.n_glyphs, 'classes': self.n_classes}
+
+# Classes of the glyphs in the coverages of the chaining rules of a lookup.
+def compile_coverage_classes(font, lookup, rules):
+	if len(rules) == 0:
+		lookup.coverage_classes = None
+		lookup.class_of = None
+		return
+	lookup.coverage_classes = CoverageClasses(font, \
+		[coverage for rule in rules for coverage in rule.coverages()])
+	lookup.class_of = lookup.coverage_classes.class_of
+	for rule in rules:
+		rule.compile_classes(lookup.coverage_classes)
+
+# Buffer of glyphs being substituted, as in production shapers: glyphs
+# before the cursor are in the output buffer, the others in the input buffer
+# from position idx. A lookup passes over the buffer once, moving glyphs
+# to the output and substituting them on the way, and then the output
+# becomes the input of the next lookup. Positions index the concatenation
+# of the output and the remaining input. The version increases with every
+# substitution.
+class GlyphBuffer:
+	def __init__(self, tokens):
+		self.info = tokens[:]
+		self.out = tokens[:0]
+		self.idx = 0
+		self.version = 0
+		self.glyph_digest = None
+		self.digest_version = None
+
+	def __len__(self):
+		return len(self.out) + len(self.info) - self.idx
+
+	def __getitem__(self, i):
+		n_out = len(self.out)
+		if type(i) is slice:
+			return self.glyphs()[i]
+		elif i < n_out:
+			return self.out[i]
+		else:
+			return self.info[self.idx + i - n_out]
+
+	def glyphs(self):
+		return self.out + self.info[self.idx:]
+
+	# Digest of the glyphs in the buffer, made again after substitutions.
+	def digest(self, font):
+		if self.digest_version != self.version:
+			self.glyph_digest = font.glyphs_digest(self.glyphs())
+			self.digest_version = self.version
+		return self.glyph_digest
+
+	# Move glyphs between input and output so that the cursor is at pos.
+	def move_to(self, pos):
+		n_out = len(self.out)
+		if pos > n_out:
+			n = min(pos - n_out, len(self.info) - self.idx)
+			self.out.extend(self.info[self.idx:self.idx+n])
+			self.idx += n
+		elif pos < n_out:
+			n = n_out - pos
+			if self.idx >= n:
+				self.info[self.idx-n:self.idx] = self.out[pos:]
+				self.idx -= n
+			else:
+				self.info[:self.idx] = self.out[pos:]
+				self.idx = 0
+			del self.out[pos:]
+
+	# Replace glyph at cursor, and move past it.
+	def replace_glyph(self, glyph):
+		self.out.append(glyph)
+		self.idx += 1
+		self.version += 1
+
+	# Replace glyph at cursor by any number of glyphs, and move past them.
+	def replace_glyphs(self, glyphs):
+		self.out.extend(glyphs)
+		self.idx += 1
+		self.version += 1
+
+	# Replace glyphs at posses, the first at the cursor, by a ligature, and
+	# move past it. Glyphs skipped between the components go back to the
+	# input, after the ligature.
+	def ligate(self, posses, glyph):
+		start = self.idx
+		end = start + posses[-1] - posses[0] + 1
+		components = {p - posses[0] + start for p in posses}
+		skipped = self.info[:0]
+		for i in range(start, end):
+			if i not in components:
+				skipped.append(self.info[i])
+		self.out.append(glyph)
+		self.idx = end - len(skipped)
+		self.info[self.idx:end] = skipped
+		self.version += 1
+
+	# Replace all glyphs, the cursor being at the start.
+	def replace_all(self, glyphs):
+		self.info = glyphs
+		self.out = glyphs[:0]
+		self.version += 1
+
+	# Output becomes input of next pass.
+	def swap(self):
+		self.out.extend(self.info[self.idx:])
+		self.info = self.out
+		self.out = self.info[:0]
+		self.idx = 0
 
 # Type 1
 class SingleSubstitution1:
@@ -57,19 +305,28 @@ class SingleSubstitution1:
 		self.input = input
 		self.output = output
 
+	def compile(self, font):
+		self.input_key = font.glyph_key(self.input)
+		self.output_key = font.glyph_key(self.output)
+
 	def length(self):
 		return 1
 
+	def first_glyphs(self):
+		return [self.input_key]
+
+	def glyphs(self):
+		return [self.input_key, self.output_key]
+
 	def recur(self, tokens, pos, font, lookup):
 		return None
 
 	def applicable(self, tokens, pos, font, lookup):
-		return pos < len(tokens) and tokens[pos] == self.input
+		return pos < len(tokens) and tokens[pos] == self.input_key
 
-	def apply(self, tokens, pos, font, lookup):
-		tokens = tokens.copy()
-		tokens[pos] = self.output
-		return tokens, 1, [pos]
+	def apply(self, buffer, pos, font, lookup):
+		buffer.replace_glyph(self.output_key)
+		return 1, [pos]
 
 	def __str__(self):
 		return self.input + ' -> ' + self.output
@@ -80,59 +337,148 @@ class MultSubstitution:
 		self.input = input
 		self.outputs = outputs
 
+	def compile(self, font):
+		self.input_key = font.glyph_key(self.input)
+		self.output_keys = glyph_keys(font, self.outputs)
+
 	def length(self):
 		return 1
 
+	def first_glyphs(self):
+		return [self.input_key]
+
+	def glyphs(self):
+		return [self.input_key] + self.output_keys
+
 	def recur(self, tokens, pos, font, lookup):
 		return None
 
 	def applicable(self, tokens, pos, font, lookup):
-		return pos < len(tokens) and tokens[pos] == self.input
+		return pos < len(tokens) and tokens[pos] == self.input_key
 
-	def apply(self, tokens, pos, font, lookup):
-		tokens = tokens.copy()
-		del tokens[pos]
-		for token in reversed(self.outputs):
-			tokens.insert(pos, token)
-		return tokens, len(self.outputs), [pos]
+	def apply(self, buffer, pos, font, lookup):
+		buffer.replace_glyphs(self.output_keys)
+		return len(self.outputs), [pos]
 
 	def __str__(self):
 		return self.input + ' -> ' + ' '.join(self.outputs)
 
+# Buffers shorter than this are substituted glyph by glyph even if the
+# lookup has a SubstitutionTable, which takes longer for few glyphs.
+SUBSTITUTION_TABLE_MIN_LENGTH = 16
+
+# Single and multiple substitutions of a lookup with interned glyphs, as the
+# sequence that replaces each glyph, for substituting all glyphs of a buffer
+# at once. Glyphs without substitution are replaced by themselves. As when
+# trying the rules in turn, the first rule for a glyph applies.
+class SubstitutionTable:
+	def __init__(self, font, substitutions):
+		n_glyphs = len(font.glyphs)
+		outputs = {}
+		for substitution in substitutions:
+			if substitution.input_key not in outputs:
+				outputs[substitution.input_key] = [substitution.output_key] \
+					if isinstance(substitution, SingleSubstitution1) else substitution.output_keys
+		self.substituted = np.zeros(n_glyphs, dtype=bool)
+		self.substituted[list(outputs)] = True
+		self.single = all(len(output) == 1 for output in outputs.values())
+		if self.single:
+			self.outputs = np.arange(n_glyphs, dtype=np.uint16)
+			self.outputs[list(outputs)] = [output[0] for output in outputs.values()]
+		else:
+			# Sequences follow the glyphs themselves in one array.
+			self.starts = np.arange(n_glyphs, dtype=np.int64)
+			self.lengths = np.ones(n_glyphs, dtype=np.int64)
+			sequences = [np.arange(n_glyphs)]
+			start = n_glyphs
+			for glyph, output in outputs.items():
+				self.starts[glyph] = start
+				self.lengths[glyph] = len(output)
+				sequences.append(np.array(output, dtype=np.int64))
+				start += len(output)
+			self.sequences = np.concatenate(sequences).astype(np.uint16)
+
+	# The glyphs after substitution, or None if no glyph is substituted.
+	def substitute(self, glyphs):
+		if not self.substituted[glyphs].any():
+			return None
+		if self.single:
+			return self.outputs[glyphs]
+		lengths = self.lengths[glyphs]
+		ends = np.cumsum(lengths)
+		indexes = np.repeat(self.starts[glyphs] - ends + lengths, lengths) + np.arange(ends[-1])
+		return self.sequences[indexes]
+
 # Type 4
 class LigSubstitution:
 	def __init__(self, inputs, output):
 		self.inputs = inputs
 		self.output = output
 
+	def compile(self, font):
+		self.input_keys = glyph_keys(font, self.inputs)
+		self.output_key = font.glyph_key(self.output)
+
 	def length(self):
 		return len(self.inputs)
 
+	def first_glyphs(self):
+		return [self.input_keys[0]]
+
+	def glyphs(self):
+		return self.input_keys + [self.output_key]
+
 	def recur(self, tokens, pos, font, lookup):
 		return None
 
 	def applicable(self, tokens, pos, font, lookup):
-		return pos < len(tokens) and tokens[pos] == self.inputs[0] and \
-			is_prefix_of(self.inputs[1:], \
-				filter_list(tokens[pos+1:], lambda t : filter_glyph(t, font, lookup)))
-
-	def apply(self, tokens, pos, font, lookup):
-		tokens = tokens.copy()
-		posses = [pos]
-		i = pos+1
-		while len(posses) < len(self.inputs):
-			if filter_glyph(tokens[i], font, lookup):
-				posses.append(i)
-			i += 1
-		for i in reversed(posses):
-			del tokens[i]
-		tokens.insert(pos, self.output)
-		return tokens, 1, posses
+		return pos < len(tokens) and tokens[pos] == self.input_keys[0] and \
+			is_prefix_of(self.input_keys[1:], glyphs_at(tokens, \
+				skip_right(tokens, pos, len(self.input_keys) - 1, lookup)))
+
+	def apply(self, buffer, pos, font, lookup):
+		posses = [pos] + skip_right(buffer, pos, len(self.input_keys) - 1, lookup)
+		buffer.ligate(posses, self.output_key)
+		return 1, posses
 
 	def __str__(self):
 		return ' '.join(self.inputs) + ' -> ' + self.output
 
-# Type 6, Format 3
+# Ligatures with the same first glyph, as trie on the other components, so
+# that the ligature is found in one walk over the glyphs the lookup does not
+# skip. As when trying the ligatures one by one, longest first, the longest
+# that matches is taken, and the first of equal ones.
+class LigatureTrie:
+	def __init__(self, substitutions):
+		self.root = [None, {}]
+		for substitution in substitutions:
+			node = self.root
+			for key in substitution.input_keys[1:]:
+				if key not in node[1]:
+					node[1][key] = [None, {}]
+				node = node[1][key]
+			if node[0] is None:
+				node[0] = substitution
+
+	def match(self, tokens, pos, lookup):
+		mask = lookup.skip_mask
+		node = self.root
+		matched = node[0]
+		pos += 1
+		end = len(tokens)
+		while len(node[1]) > 0 and pos < end:
+			glyph = tokens[pos]
+			if not mask[glyph]:
+				node = node[1].get(glyph)
+				if node is None:
+					break
+				if node[0] is not None:
+					matched = node[0]
+			pos += 1
+		return matched
+
+# Type 6, Format 3, with coverages in buffer order, backtrack too. Also
+# Format 1, with single glyphs instead of coverages.
 class ChainSubstitution3:
 	def __init__(self, lefts, inputs, rights, refs):
 		self.lefts = lefts
@@ -143,6 +489,34 @@ class ChainSubstitution3:
 	def length(self):
 		return len(self.lefts) + len(self.inputs) + len(self.rights)
 
+	def compile(self, font):
+		self.left_keys = coverages_keys(font, self.lefts)
+		self.input_keys = coverages_keys(font, self.inputs)
+		self.right_keys = coverages_keys(font, self.rights)
+
+	def coverages(self):
+		return self.left_keys + self.input_keys + self.right_keys
+
+	def compile_classes(self, coverage_classes):
+		self.left_keys = coverage_classes.share(self.left_keys)
+		self.input_keys = coverage_classes.share(self.input_keys)
+		self.right_keys = coverage_classes.share(self.right_keys)
+		self.left_classes = coverage_classes.classes_of(self.left_keys)
+		self.input_classes = coverage_classes.classes_of(self.input_keys)
+		self.right_classes = coverage_classes.classes_of(self.right_keys)
+		self.following_classes = self.input_classes[1:] + self.right_classes
+
+	def first_glyphs(self):
+		if len(self.input_keys) == 0:
+			return []
+		elif isinstance(self.input_keys[0], frozenset):
+			return self.input_keys[0]
+		else:
+			return [self.input_keys[0]]
+
+	def glyphs(self):
+		return coverages_glyphs(self.left_keys + self.input_keys + self.right_keys)
+
 	def recur(self, tokens, pos, font, lookup):
 		posses = self.filtered_input_positions(tokens, pos, font, lookup)
 		return [(posses[p], index) for (p, index) in self.refs]
@@ -157,22 +531,19 @@ class ChainSubstitution3:
 				print(filter_list(tokens[:pos], lambda t : filter_glyph(t, font, lookup)))
 				print(tokens[pos:])
 				print(filter_list(tokens[pos:], lambda t : filter_glyph(t, font, lookup)))
+		class_of = lookup.class_of
 		return pos < len(tokens) and \
-			equiv(tokens[pos], self.inputs[0]) and \
-			is_suffix_of(self.lefts, filter_list(tokens[:pos], \
-				lambda t : filter_glyph(t, font, lookup))) and \
-			is_prefix_of(self.inputs[1:] + self.rights, filter_list(tokens[pos+1:], \
-				lambda t : filter_glyph(t, font, lookup)))
+			class_of[tokens[pos]] in self.input_classes[0] and \
+			classes_match(self.left_classes, tokens, \
+				skip_left(tokens, pos, len(self.left_classes), lookup), class_of) and \
+			classes_match(self.following_classes, tokens, \
+				skip_right(tokens, pos, len(self.following_classes), lookup), class_of)
 
-	def apply(self, tokens, pos, font, lookup):
-		return tokens, 0, posses
+	def apply(self, buffer, pos, font, lookup):
+		return 0, []
 
 	def filtered_input_positions(self, tokens, pos, font, lookup):
-		posses = [pos]
-		for p in range(pos+1, len(tokens)):
-			if filter_glyph(tokens[p], font, lookup):
-				posses.append(p)
-		return posses[:len(self.inputs)]
+		return [pos] + skip_right(tokens, pos, len(self.input_keys) - 1, lookup)
 
 	def __str__(self):
 		lefts = ' '.join([l if isinstance(l, str) else '/'.join(l) for l in self.lefts])
@@ -181,6 +552,190 @@ class ChainSubstitution3:
 		refs = ' '.join([str(index) + '->' + str(lookup) for (index, lookup) in self.refs])
 		return lefts + '|' + inputs + '|' + rights + ' ---> ' + refs
 
+# Type 6, Format 2: a rule of a ChainSubstitution2, with classes of the
+# backtrack (in buffer order), input and lookahead ClassDefs.
+class ChainClassRule:
+	def __init__(self, lefts, inputs, rights, refs):
+		self.lefts = lefts
+		self.inputs = inputs
+		self.rights = rights
+		self.refs = refs
+		self.left_classes = [frozenset([cl]) for cl in lefts]
+		self.input_classes = [frozenset([cl]) for cl in inputs]
+		self.right_classes = [frozenset([cl]) for cl in rights]
+
+	def length(self):
+		return len(self.lefts) + len(self.inputs) + len(self.rights)
+
+	def recur(self, tokens, pos, font, lookup):
+		posses = self.filtered_input_positions(tokens, pos, font, lookup)
+		return [(posses[p], index) for (p, index) in self.refs]
+
+	def apply(self, buffer, pos, font, lookup):
+		return 0, []
+
+	def filtered_input_positions(self, tokens, pos, font, lookup):
+		return [pos] + skip_right(tokens, pos, len(self.inputs) - 1, lookup)
+
+	def __str__(self):
+		refs = ' '.join([str(index) + '->' + str(lookup) for (index, lookup) in self.refs])
+		return ' '.join(str(cl) for cl in self.lefts) + '|' + \
+			' '.join(str(cl) for cl in self.inputs) + '|' + \
+			' '.join(str(cl) for cl in self.rights) + ' ---> ' + refs
+
+# Type 6, Format 2
+# Glyphs in coverage starting rules over classes of glyphs. Rule sets are
+# indexed by the input class of the first glyph, and the first rule of the
+# set that matches applies. ClassDefs become tables from glyph keys to
+# classes, glyphs not in a ClassDef having class 0.
+class ChainSubstitution2:
+	def __init__(self, coverage, left_classes, input_classes, right_classes, rule_sets):
+		self.coverage = coverage
+		self.left_classes = left_classes
+		self.input_classes = input_classes
+		self.right_classes = right_classes
+		self.rule_sets = rule_sets
+
+	def compile(self, font):
+		self.coverage_keys = frozenset(glyph_keys(font, self.coverage))
+		self.left_class_of = class_table(font, self.left_classes)
+		self.input_class_of = class_table(font, self.input_classes)
+		self.right_class_of = class_table(font, self.right_classes)
+		# Class 0 in context is any glyph not in the ClassDef.
+		if any(0 in rule.lefts + rule.inputs[1:] + rule.rights \
+				for rules in self.rule_sets for rule in rules):
+			self.glyph_keys = [font.glyph_key(g) for g in font.glyphs]
+		else:
+			self.glyph_keys = list(self.coverage_keys) + \
+				[font.glyph_key(g) for classes in \
+					[self.left_classes, self.input_classes, self.right_classes] for g in classes]
+
+	def length(self):
+		return max([rule.length() for rules in self.rule_sets for rule in rules], default=1)
+
+	def first_glyphs(self):
+		return self.coverage_keys
+
+	def glyphs(self):
+		return self.glyph_keys
+
+	# The rule that matches at pos, whose glyph is in coverage, if any.
+	def match(self, tokens, pos, lookup):
+		cl = self.input_class_of[tokens[pos]]
+		if cl >= len(self.rule_sets):
+			return None
+		for rule in self.rule_sets[cl]:
+			n_inputs = len(rule.inputs) - 1
+			posses = skip_right(tokens, pos, n_inputs + len(rule.rights), lookup)
+			if classes_match(rule.input_classes[1:], tokens, posses[:n_inputs], self.input_class_of) and \
+					classes_match(rule.right_classes, tokens, posses[n_inputs:], self.right_class_of) and \
+					classes_match(rule.left_classes, tokens, \
+						skip_left(tokens, pos, len(rule.lefts), lookup), self.left_class_of):
+				return rule
+		return None
+
+	def __str__(self):
+		return '/'.join(self.coverage) + ' ' + \
+			str(sum(len(rules) for rules in self.rule_sets)) + ' class rules'
+
+# Deterministic automaton recognizing the backtrack, input and lookahead
+# coverages of chaining rules in the sequence of glyphs a lookup does not
+# skip, over the classes of the coverages of the lookup. States are sets of
+# partial matches, made when first reached. If there would be more than
+# max_states, the automaton gives up.
+class ChainAutomaton:
+	def __init__(self, substitutions, class_of, max_states=10000):
+		self.substitutions = substitutions
+		self.max_states = max_states
+		self.class_of = class_of
+		self.patterns = [s.left_classes + s.input_classes + s.right_classes for s in substitutions]
+		self.tails = [len(s.input_keys) + len(s.right_keys) - 1 for s in substitutions]
+		self.max_tail = max(self.tails)
+		self.starts = [(r, 0) for r in range(len(substitutions))]
+		self.transitions = {}
+		self.states = set()
+
+	# Next state and rules whose match ends here, or None if too many states.
+	def step(self, state, cl):
+		key = (state, cl)
+		if key not in self.transitions:
+			partial = []
+			matched = []
+			for r, k in state + tuple(self.starts):
+				if cl in self.patterns[r][k]:
+					if k + 1 == len(self.patterns[r]):
+						matched.append(r)
+					else:
+						partial.append((r, k + 1))
+			next_state = tuple(partial)
+			if next_state not in self.states:
+				if len(self.states) >= self.max_states:
+					return None
+				self.states.add(next_state)
+			self.transitions[key] = (next_state, matched)
+		return self.transitions[key]
+
+# Candidate rules at positions of a buffer during a pass of a lookup with an
+# automaton. The buffer is scanned only as far as needed to know the
+# matches at the position asked for. A substitution changes the buffer
+# only from the position of the rule that caused it, so after a change
+# scanning resumes from there.
+class ChainScan:
+	def __init__(self, lookup, buffer):
+		self.lookup = lookup
+		self.automaton = lookup.automaton
+		self.buffer = buffer
+		self.version = buffer.version
+		self.last_pos = 0
+		self.restart(0)
+
+	# Forget what was scanned from pos onward.
+	def restart(self, pos):
+		if pos == 0:
+			self.posses = []
+			self.states = []
+			self.matches = {}
+		else:
+			j = bisect.bisect_left(self.posses, pos)
+			del self.posses[j:]
+			del self.states[j:]
+			self.matches = {start: rules for start, rules in self.matches.items() if start < pos}
+		self.next = pos
+
+	# Rules that may match at pos, or None if not known.
+	def candidates(self, pos):
+		mask = self.lookup.skip_mask
+		tokens = self.buffer
+		if mask[tokens[pos]]:
+			return None
+		if self.version != tokens.version:
+			self.restart(min(pos, self.last_pos))
+			self.version = tokens.version
+		elif pos < self.last_pos:
+			self.restart(0)
+		self.last_pos = pos
+		automaton = self.automaton
+		end = len(tokens)
+		after = len(self.posses) - bisect.bisect_right(self.posses, pos)
+		while self.next < end and (self.next <= pos or after < automaton.max_tail):
+			glyph = tokens[self.next]
+			if not mask[glyph]:
+				state = self.states[-1] if len(self.states) > 0 else ()
+				transition = automaton.step(state, automaton.class_of[glyph])
+				if transition is None:
+					self.lookup.automaton = None
+					return None
+				state, matched = transition
+				self.posses.append(self.next)
+				self.states.append(state)
+				for r in matched:
+					start = self.posses[len(self.posses) - 1 - automaton.tails[r]]
+					self.matches.setdefault(start, set()).add(automaton.substitutions[r])
+				if self.next > pos:
+					after += 1
+			self.next += 1
+		return self.matches.get(pos, ())
+
 # Type 8
 class ReverseSubstitution:
 	def __init__(self, lefts, inputs, rights, outputs):
@@ -192,13 +747,23 @@ class ReverseSubstitution:
 	def length(self):
 		return len(self.lefts) + 1 + len(self.rights)
 
+	def compile(self, font):
+		None
+
+	def first_glyphs(self):
+		return []
+
+	# Never applied.
+	def glyphs(self):
+		return []
+
 	def recur(self, tokens, pos, font, lookup):
 		return None
 
 	def applicable(self, tokens, pos, font, lookup):
 		return False
 
-	def apply(self, tokens, pos, font, lookup):
+	def apply(self, buffer, pos, font, lookup):
 		print("Type 8 not implemented")
 		exit(0)
 
@@ -216,55 +781,148 @@ class GSUB_Lookup:
 		self.mark_class = 0
 		self.filter_set = None
 		self.substitutions = []
-
+		self.dispatch = None
+		self.automaton = None
+		self.coverage_classes = None
+		self.substitution_table = None
+		self.digest = None
+		self.applied = 0
+		self.skipped = 0
+		self.font = None
+
+	# The font owning the lookup, if any, is told of the change.
 	def add(self, substitution):
 		self.substitutions.append(substitution)
+		self.dispatch = None
+		if self.font is not None:
+			self.font.changed()
 
 	# Normally one shouldn't use this. The textual order should be the order
 	# in which rules are attempted.
 	def reorder(self):
 		self.substitutions = sorted(self.substitutions, key=lambda s : s.length())
-
-	def apply(self, tokens, font):
-		pos = 0
-		applications = []
-		while pos < len(tokens):
-			tokens, application, jump = self.apply_at(tokens, pos, font)
-			if application is not None:
-				applications.append(application)
-				pos += jump
-			else:
-				pos += 1
-		return tokens, applications
-
-	def apply_at(self, tokens, pos, font):
+		self.dispatch = None
+		if self.font is not None:
+			self.font.changed()
+
+	# Map each glyph to the rules that can start with it, longest first,
+	# as otherwise found by sorting all rules at every position. Several
+	# ligatures are combined into a trie. Subtables of class-based chaining
+	# rules are tried as a whole, finding their rule by class.
+	def compile(self, font):
+		self.skip_mask = skip_mask(font, self)
+		self.dispatch = {}
+		for substitution in self.substitutions:
+			substitution.compile(font)
+		compile_coverage_classes(font, self, \
+			[s for s in self.substitutions if isinstance(s, ChainSubstitution3)])
 		for substitution in sorted(self.substitutions, key=lambda s : -s.length()):
-			if substitution.applicable(tokens, pos, font, self):
-				recur = substitution.recur(tokens, pos, font, self)
-				if recur is not None:
-					if len(recur) > 0:
-						posses = substitution.filtered_input_positions(tokens, pos, font, self)
-						len_pre = len(tokens)
-						application = {'index': str(self.index), 'posses': posses, 'rule': substitution, \
-							'tokens': tokens}
-						for pos2, recurred in recur:
-							recur_lookup = font.GSUB_lookups[recurred]
-							tokens, application_recur, _ = recur_lookup.apply_at(tokens, pos2, font)
-							if application_recur is not None:
-								application['index'] += '/' + application_recur['index']
-						application['tokens'] = tokens
-						len_post = len(tokens)
-						jump = len_post-len_pre + 1
-					else:
-						application = {'index': str(self.index), 'posses': [pos], 'rule': substitution, \
-							'tokens': tokens} 
-						jump = 1
+			for glyph in dict.fromkeys(substitution.first_glyphs()):
+				if glyph not in self.dispatch:
+					self.dispatch[glyph] = []
+				self.dispatch[glyph].append(substitution)
+		for glyph, substitutions in self.dispatch.items():
+			if len(substitutions) > 1 and \
+					all(isinstance(s, LigSubstitution) for s in substitutions):
+				self.dispatch[glyph] = [LigatureTrie(substitutions)]
+		if font.chain_automata and len(self.substitutions) > 1 and \
+				all(isinstance(s, ChainSubstitution3) for s in self.substitutions):
+			self.automaton = ChainAutomaton(self.substitutions, self.class_of)
+		else:
+			self.automaton = None
+		if font.interned and len(self.substitutions) > 0 and all(isinstance(s, \
+				(SingleSubstitution1, MultSubstitution)) for s in self.substitutions):
+			self.substitution_table = SubstitutionTable(font, self.substitutions)
+		else:
+			self.substitution_table = None
+		self.digest = font.glyphs_digest(self.dispatch)
+
+	def glyphs(self):
+		for substitution in self.substitutions:
+			yield from substitution.glyphs()
+
+	# Whether a rule can start at a glyph of a buffer with the digest.
+	def may_apply(self, digest, font):
+		if self.dispatch is None:
+			self.compile(font)
+		return digests_overlap(self.digest, digest)
+
+	# One pass over the buffer, substituting in place. Glyphs that start no
+	# rule are moved to the output directly. Lookups of single and multiple
+	# substitutions substitute all glyphs of long buffers at once unless
+	# traced.
+	def apply(self, buffer, font, tracer=None):
+		if self.dispatch is None:
+			self.compile(font)
+		if self.substitution_table is not None and font.vectorised and tracer is None and \
+				len(buffer) >= SUBSTITUTION_TABLE_MIN_LENGTH:
+			self.apply_table(buffer)
+			return
+		scan = ChainScan(self, buffer) if self.automaton is not None else None
+		info = buffer.info
+		out = buffer.out
+		while buffer.idx < len(info):
+			glyph = info[buffer.idx]
+			if glyph in self.dispatch:
+				pos = len(out)
+				candidates = scan.candidates(pos) if self.automaton is not None else None
+				substitution, jump = self.apply_at(buffer, pos, font, tracer, candidates=candidates)
+				if substitution is not None:
+					if tracer is not None:
+						tracer.buffer_changed(buffer, None)
+					buffer.move_to(max(pos + jump, 0))
+					continue
+			out.append(glyph)
+			buffer.idx += 1
+		buffer.swap()
+
+	# The buffer is at its start, as between passes.
+	def apply_table(self, buffer):
+		glyphs = self.substitution_table.substitute(np.asarray(buffer.info))
+		if glyphs is not None:
+			buffer.replace_all(array('H', glyphs.tobytes()))
+
+	# The rule that matched at pos, if any, and the number of positions to
+	# move forward. Lookups applied by the rule report their matches to the
+	# tracer with greater depth. If candidates are given, other rules are
+	# not tried.
+	def apply_at(self, buffer, pos, font, tracer=None, depth=0, candidates=None):
+		if self.dispatch is None:
+			self.compile(font)
+		if pos >= len(buffer):
+			return None, 0
+		for substitution in self.dispatch.get(buffer[pos], []):
+			if candidates is not None and substitution not in candidates:
+				continue
+			if isinstance(substitution, (LigatureTrie, ChainSubstitution2)):
+				substitution = substitution.match(buffer, pos, self)
+				if substitution is None:
+					continue
+			elif not substitution.applicable(buffer, pos, font, self):
+				continue
+			recur = substitution.recur(buffer, pos, font, self)
+			if recur is not None:
+				if len(recur) > 0:
+					posses = substitution.filtered_input_positions(buffer, pos, font, self)
+					if tracer is not None:
+						tracer.rule_matched(self, substitution, posses, depth)
+					len_pre = len(buffer)
+					for pos2, recurred in recur:
+						recur_lookup = font.GSUB_lookups[recurred]
+						recur_lookup.apply_at(buffer, pos2, font, tracer, depth + 1)
+					len_post = len(buffer)
+					jump = len_post-len_pre + 1
 				else:
-					tokens, jump, posses = substitution.apply(tokens, pos, font, self)
-					application = {'index': str(self.index), 'posses': posses, 'rule': substitution, \
-						'tokens': tokens}
-				return tokens, application, jump
-		return tokens, None, 0
+					if tracer is not None:
+						tracer.rule_matched(self, substitution, [pos], depth)
+					jump = 1
+			else:
+				buffer.move_to(pos)
+				jump, posses = substitution.apply(buffer, pos, font, self)
+				if tracer is not None:
+					tracer.rule_matched(self, substitution, posses, depth)
+			return substitution, jump
+		return None, 0
 
 	def __str__(self):
 		s = 'GSUB LOOKUP ' + str(self.index)
@@ -283,78 +941,356 @@ class GSUB_Lookup:
 			s += '\n' + sub
 		return s
 
+# Positionings of the glyphs of a buffer, one record per glyph. Placements
+# move the glyph, and XAdvance adjusts its advance. A glyph attached to
+# another, Attach positions before it, is placed at XCoordinate and
+# YCoordinate from it. GPOS lookups change positionings in place.
+POSITIONING = np.dtype([('XPlacement', np.int32), ('YPlacement', np.int32), \
+	('XAdvance', np.int32), ('XCoordinate', np.int32), ('YCoordinate', np.int32), \
+	('Attach', np.int32)])
+
+def new_positionings(n):
+	return np.zeros(n, dtype=POSITIONING)
+
+# Fields of a positioning that are set, with their values.
+def positioning_items(positioning):
+	return [(field, int(positioning[field])) for field in POSITIONING.names \
+		if positioning[field] != 0]
+
+# Adjustments of value records that positionings have, as records of
+# compact arrays. Other fields of value records are ignored.
+VALUE = np.dtype([('XPlacement', np.int16), ('YPlacement', np.int16), ('XAdvance', np.int16)])
+
+def new_values(shape):
+	return np.zeros(shape, dtype=VALUE)
+
+# Set fields of the value record at index from a dict.
+def set_value(values, index, value):
+	for field, v in value.items():
+		if field in VALUE.names:
+			values[field][index] = v
+
+def adjusts(values):
+	return any(values[field].any() for field in VALUE.names)
+
+# Adjustments are added to those of earlier lookups.
+def add_values(positionings, posses, values):
+	for field in VALUE.names:
+		positionings[field][posses] += values[field]
+
 # Type 1
 class SingleAdjustment:
 	def __init__(self, form, adjustments):
 		self.form = form
 		self.adjustments = adjustments
 
+	def compile(self, font):
+		self.glyph_keys = [font.glyph_key(adjs['glyph']) for adjs in self.adjustments]
+
 	def length(self):
 		return 1
 
+	def first_glyphs(self):
+		return self.glyph_keys
+
+	def glyphs(self):
+		return self.glyph_keys
+
 	def recur(self):
 		return None
 
 	def applicable(self, tokens, pos, font, lookup):
-		return tokens[pos] in [adj[0] for adj in self.adjustments]
+		return tokens[pos] in self.glyph_keys
 
 	def apply(self, tokens, positionings, pos, font, lookup):
-		positionings = positionings.copy()
-		for adjs in self.adjustments:
-			if adjs['glyph'] == tokens[pos]:
-				placement = adjs['placement']
-				if 'XPlacement' in placement:
-					positionings['XPlacement'] = placement['XPlacement']
-				if 'YPlacement' in placement:
-					positionings['YPlacement'] = placement['YPlacement']
-			return positionings
+		for key, adjs in zip(self.glyph_keys, self.adjustments):
+			if key == tokens[pos]:
+				for field, value in adjs['placement'].items():
+					positionings[field][pos] = value
+				break
+		return positionings
 
 	def __str__(self):
 		return ' '.join([str((g,a)) for (g,a) in self.adjustments])
 
+# Single adjustments of a lookup with interned glyphs, as the placements
+# each glyph gets, for adjusting all glyphs of a buffer at once. Fields are
+# set only for glyphs whose adjustment has them. As when trying the rules in
+# turn, the first record for a glyph in the first subtable with it applies.
+class AdjustmentTable:
+	def __init__(self, font, adjustments):
+		placements = {}
+		for adjustment in adjustments:
+			for key, adjs in zip(adjustment.glyph_keys, adjustment.adjustments):
+				placements.setdefault(key, adjs['placement'])
+		self.values = new_values(len(font.glyphs))
+		self.sets = {}
+		for key, placement in placements.items():
+			for field, value in placement.items():
+				if field not in self.sets:
+					self.sets[field] = np.zeros(len(font.glyphs), dtype=bool)
+				self.sets[field][key] = True
+				self.values[field][key] = value
+
+	def apply(self, glyphs, positionings):
+		for field, sets in self.sets.items():
+			posses = np.nonzero(sets[glyphs])[0]
+			positionings[field][posses] = self.values[field][glyphs[posses]]
+
+# Type 2, Format 1
+# Pairs of glyphs, firsts[i] and seconds[i], with adjustments values1[i] of
+# the first and values2[i] of the second. If values2 is None, the value
+# format of the second glyph is empty, and the second glyph can start the
+# next pair.
+class PairAdjustment1:
+	def __init__(self, firsts, seconds, values1, values2):
+		self.firsts = firsts
+		self.seconds = seconds
+		self.values1 = values1
+		self.values2 = values2
+
+	# Pairs as dict, and, with glyph indexes, as sorted codes of pairs for
+	# vectorised lookups (see GPOS_Lookup.apply_pairs).
+	def compile(self, font):
+		self.first_keys = glyph_keys(font, self.firsts)
+		self.second_keys = glyph_keys(font, self.seconds)
+		self.pair_indexes = record_indexes(zip(self.first_keys, self.second_keys))
+		if font.interned:
+			codes = np.array(self.first_keys, dtype=np.int64) * len(font.glyphs) + \
+				np.array(self.second_keys, dtype=np.int64)
+			self.order = np.argsort(codes, kind='stable')
+			self.codes = codes[self.order]
+
+	def length(self):
+		return 2
+
+	def first_glyphs(self):
+		return self.first_keys
+
+	def glyphs(self):
+		return self.first_keys + self.second_keys
+
+	def recur(self):
+		return None
+
+	def applicable(self, tokens, pos, font, lookup):
+		return self.pair(tokens, pos, lookup) >= 0
+
+	def apply(self, tokens, positionings, pos, font, lookup):
+		index = self.pair(tokens, pos, lookup)
+		pos2 = skip_right(tokens, pos, 1, lookup)[0]
+		add_values(positionings, pos, self.values1[index])
+		if self.values2 is not None:
+			add_values(positionings, pos2, self.values2[index])
+		return positionings
+
+	def pair(self, tokens, pos, lookup):
+		if lookup.skip_mask[tokens[pos]]:
+			return -1
+		posses = skip_right(tokens, pos, 1, lookup)
+		if len(posses) == 0:
+			return -1
+		return self.pair_indexes.get((tokens[pos], tokens[posses[0]]), -1)
+
+	# Which of pairs of glyph indexes match, with adjustments.
+	def match_pairs(self, glyphs1, glyphs2, n_glyphs):
+		if len(self.codes) == 0:
+			values2 = new_values(len(glyphs1)) if self.values2 is not None else None
+			return np.zeros(len(glyphs1), dtype=bool), new_values(len(glyphs1)), values2
+		codes = glyphs1.astype(np.int64) * n_glyphs + glyphs2
+		found = np.minimum(np.searchsorted(self.codes, codes), len(self.codes) - 1)
+		matched = self.codes[found] == codes
+		indexes = self.order[found]
+		values2 = self.values2[indexes] if self.values2 is not None else None
+		return matched, self.values1[indexes], values2
+
+	def __str__(self):
+		return ' '.join(first + ' ' + second for first, second in zip(self.firsts, self.seconds))
+
+# Type 2, Format 2
+# Glyphs in coverage followed by any glyph, with adjustments by class of
+# both glyphs, in arrays indexed by (ClassDef1, ClassDef2). Glyphs not in
+# classes1 or classes2 have class 0.
+class PairAdjustment2:
+	def __init__(self, coverage, classes1, classes2, values1, values2):
+		self.coverage = coverage
+		self.classes1 = classes1
+		self.classes2 = classes2
+		self.values1 = values1
+		self.values2 = values2
+
+	def compile(self, font):
+		self.coverage_keys = frozenset(glyph_keys(font, self.coverage))
+		self.class1_of = class_table(font, self.classes1)
+		self.class2_of = class_table(font, self.classes2)
+		# Glyphs of class 0 are second glyphs too if adjusted.
+		if adjusts(self.values1[:, 0]) or (self.values2 is not None and adjusts(self.values2[:, 0])):
+			self.second_keys = [font.glyph_key(g) for g in font.glyphs]
+		else:
+			self.second_keys = [font.glyph_key(g) for g in self.classes2]
+		if font.interned:
+			self.covered = np.zeros(len(font.glyphs), dtype=bool)
+			self.covered[list(self.coverage_keys)] = True
+			self.class1_array = np.asarray(self.class1_of)
+			self.class2_array = np.asarray(self.class2_of)
+
+	def length(self):
+		return 2
+
+	def first_glyphs(self):
+		return self.coverage_keys
+
+	def glyphs(self):
+		return list(self.coverage_keys) + self.second_keys
+
+	def recur(self):
+		return None
+
+	def applicable(self, tokens, pos, font, lookup):
+		return tokens[pos] in self.coverage_keys and not lookup.skip_mask[tokens[pos]] and \
+			len(skip_right(tokens, pos, 1, lookup)) > 0
+
+	def apply(self, tokens, positionings, pos, font, lookup):
+		pos2 = skip_right(tokens, pos, 1, lookup)[0]
+		cl1 = self.class1_of[tokens[pos]]
+		cl2 = self.class2_of[tokens[pos2]]
+		add_values(positionings, pos, self.values1[cl1, cl2])
+		if self.values2 is not None:
+			add_values(positionings, pos2, self.values2[cl1, cl2])
+		return positionings
+
+	# Which of pairs of glyph indexes match, with adjustments.
+	def match_pairs(self, glyphs1, glyphs2, n_glyphs):
+		cl1 = self.class1_array[glyphs1]
+		cl2 = self.class2_array[glyphs2]
+		values2 = self.values2[cl1, cl2] if self.values2 is not None else None
+		return self.covered[glyphs1], self.values1[cl1, cl2], values2
+
+	def __str__(self):
+		return ' '.join(self.coverage) + ' ' + str(self.values1.shape)
+
+# Index of the first record of each glyph.
+def record_indexes(keys):
+	indexes = {}
+	for index, key in enumerate(keys):
+		indexes.setdefault(key, index)
+	return indexes
+
+# Anchors of the records of glyphs to attach to, by mark class: arrays of
+# x and y, and whether the record has an anchor for the class. Coordinates
+# are int16 and mark classes uint16, as in the font.
+def anchor_arrays(records, n_classes):
+	anchors = []
+	for cl in range(n_classes):
+		xs = array('h', [0]) * len(records)
+		ys = array('h', [0]) * len(records)
+		present = bytearray(len(records))
+		for index, record in enumerate(records):
+			coordinates = record['coordinates'].get(cl)
+			if coordinates is not None:
+				xs[index] = coordinates['x']
+				ys[index] = coordinates['y']
+				present[index] = 1
+		anchors.append((xs, ys, present))
+	return anchors
+
+# Mark classes and anchors of the records of marks to attach.
+def mark_arrays(marks):
+	return array('H', [mark['class'] for mark in marks]), \
+		array('h', [mark['x'] for mark in marks]), array('h', [mark['y'] for mark in marks])
+
+def n_mark_classes(marks, records):
+	return 1 + max([mark['class'] for mark in marks] + \
+		[cl for record in records for cl in record['coordinates']], default=-1)
+
+# Nearest base glyph, and nearest glyph the lookup does not skip, before
+# each position of a buffer, found in one pass.
+class PrecedingGlyphs:
+	def __init__(self, tokens, font, lookup):
+		self.tokens = tokens
+		self.bases = array('l')
+		self.unskipped = array('l')
+		class_of = font.class_of
+		mask = lookup.skip_mask
+		base = -1
+		unskipped = -1
+		for pos, glyph in enumerate(tokens):
+			self.bases.append(base)
+			self.unskipped.append(unskipped)
+			if class_of[glyph] == BASE_GLYPH:
+				base = pos
+			if not mask[glyph]:
+				unskipped = pos
+
+# Position of the nearest base glyph before pos, or -1. Outside a pass of
+# the lookup, as when applied by a chaining rule, the buffer is searched.
+def preceding_base(tokens, pos, font, lookup):
+	if lookup.preceding is not None and lookup.preceding.tokens is tokens:
+		return lookup.preceding.bases[pos]
+	class_of = font.class_of
+	pos -= 1
+	while pos >= 0 and class_of[tokens[pos]] != BASE_GLYPH:
+		pos -= 1
+	return pos
+
+# Position of the nearest glyph before pos that the lookup does not skip,
+# or -1.
+def preceding_unskipped(tokens, pos, lookup):
+	if lookup.preceding is not None and lookup.preceding.tokens is tokens:
+		return lookup.preceding.unskipped[pos]
+	return (skip_left(tokens, pos, 1, lookup) or [-1])[0]
+
 # Type 4
 class MarkBaseAttachment:
 	def __init__(self, marks, bases):
 		self.marks = marks
 		self.bases = bases
 
+	def compile(self, font):
+		self.mark_keys = [font.glyph_key(mark['glyph']) for mark in self.marks]
+		self.base_keys = [font.glyph_key(base['glyph']) for base in self.bases]
+		self.mark_indexes = record_indexes(self.mark_keys)
+		self.base_indexes = record_indexes(self.base_keys)
+		self.mark_classes, self.mark_xs, self.mark_ys = mark_arrays(self.marks)
+		self.anchors = anchor_arrays(self.bases, n_mark_classes(self.marks, self.bases))
+
 	def length(self):
 		return 2
 
+	def first_glyphs(self):
+		return self.mark_keys
+
+	def glyphs(self):
+		return self.mark_keys + self.base_keys
+
 	def recur(self):
 		return None
 
 	def applicable(self, tokens, pos, font, lookup):
 		mark_index = self.mark(tokens, pos, font, lookup)
+		if mark_index < 0:
+			return False
 		pos_base, base_index = self.base(tokens, pos, font, lookup)
-		return mark_index >= 0 and base_index >= 0
+		return base_index >= 0 and self.anchors[self.mark_classes[mark_index]][2][base_index]
 
 	def apply(self, tokens, positionings, pos, font, lookup):
-		positionings = positionings.copy()
 		mark_index = self.mark(tokens, pos, font, lookup)
 		pos_base, base_index = self.base(tokens, pos, font, lookup)
-		mark = self.marks[mark_index]
-		base = self.bases[base_index]
-		cl = mark['class']
-		# positionings[pos_base]['XCoordinate'] = mark['x']
-		# positionings[pos_base]['YCoordinate'] = mark['y']
-		positionings[pos]['XCoordinate'] = base['coordinates'][cl]['x'] - mark['x']
-		positionings[pos]['YCoordinate'] = base['coordinates'][cl]['y'] - mark['y']
+		xs, ys, present = self.anchors[self.mark_classes[mark_index]]
+		positionings['XCoordinate'][pos] = xs[base_index] - self.mark_xs[mark_index]
+		positionings['YCoordinate'][pos] = ys[base_index] - self.mark_ys[mark_index]
+		positionings['Attach'][pos] = pos_base - pos
 		return positionings
 
 	def mark(self, tokens, pos, font, lookup):
-		for index, mark in enumerate(self.marks):
-			if mark['glyph'] == tokens[pos]:
-				return index
-		return -1
+		return self.mark_indexes.get(tokens[pos], -1)
 
 	def base(self, tokens, pos, font, lookup):
-		pref = tokens[:pos]
-		pos_base = first_filtered_right(pref, lambda t : font.glyph_to_class[t] == BASE_GLYPH)
+		pos_base = preceding_base(tokens, pos, font, lookup)
 		if pos_base >= 0:
-			for index, base in enumerate(self.bases):
-				if base['glyph'] == tokens[pos_base]:
-					return pos_base, index 
+			index = self.base_indexes.get(tokens[pos_base], -1)
+			if index >= 0:
+				return pos_base, index
 		return -1, -1
 
 	def __str__(self):
@@ -366,43 +1302,51 @@ class MarkMarkAttachment:
 		self.marks1 = marks1
 		self.marks2 = marks2
 
+	def compile(self, font):
+		self.mark1_keys = [font.glyph_key(mark['glyph']) for mark in self.marks1]
+		self.mark2_keys = [font.glyph_key(mark['glyph']) for mark in self.marks2]
+		self.mark1_indexes = record_indexes(self.mark1_keys)
+		self.mark2_indexes = record_indexes(self.mark2_keys)
+		self.mark1_classes, self.mark1_xs, self.mark1_ys = mark_arrays(self.marks1)
+		self.anchors = anchor_arrays(self.marks2, n_mark_classes(self.marks1, self.marks2))
+
 	def length(self):
 		return 2
 
+	def first_glyphs(self):
+		return self.mark1_keys
+
+	def glyphs(self):
+		return self.mark1_keys + self.mark2_keys
+
 	def recur(self):
 		return None
 
 	def applicable(self, tokens, pos, font, lookup):
 		mark1_index = self.mark1(tokens, pos, font, lookup)
+		if mark1_index < 0:
+			return False
 		pos_mark2, mark2_index = self.mark2(tokens, pos, font, lookup)
-		return mark1_index >= 0 and mark2_index >= 0
+		return mark2_index >= 0 and self.anchors[self.mark1_classes[mark1_index]][2][mark2_index]
 
 	def apply(self, tokens, positionings, pos, font, lookup):
-		positionings = [d.copy() for d in positionings]
 		mark1_index = self.mark1(tokens, pos, font, lookup)
 		pos_mark2, mark2_index = self.mark2(tokens, pos, font, lookup)
-		mark1 = self.marks1[mark1_index]
-		mark2 = self.marks2[mark2_index]
-		cl = mark1['class']
-		# positionings[pos_mark2]['XCoordinate'] = mark1['x']
-		# positionings[pos_mark2]['YCoordinate'] = mark1['y']
-		positionings[pos]['XCoordinate'] = mark2['coordinates'][cl]['x'] - mark1['x']
-		positionings[pos]['YCoordinate'] = mark2['coordinates'][cl]['y'] - mark1['y']
+		xs, ys, present = self.anchors[self.mark1_classes[mark1_index]]
+		positionings['XCoordinate'][pos] = xs[mark2_index] - self.mark1_xs[mark1_index]
+		positionings['YCoordinate'][pos] = ys[mark2_index] - self.mark1_ys[mark1_index]
+		positionings['Attach'][pos] = pos_mark2 - pos
 		return positionings
 
 	def mark1(self, tokens, pos, font, lookup):
-		for index, mark in enumerate(self.marks1):
-			if mark['glyph'] == tokens[pos]:
-				return index
-		return -1
+		return self.mark1_indexes.get(tokens[pos], -1)
 
 	def mark2(self, tokens, pos, font, lookup):
-		pref = tokens[:pos]
-		pos_mark2 = first_filtered_right(pref, lambda t : filter_glyph(t, font, lookup))
+		pos_mark2 = preceding_unskipped(tokens, pos, lookup)
 		if pos_mark2 >= 0:
-			for index, mark in enumerate(self.marks2):
-				if mark['glyph'] == tokens[pos_mark2]:
-					return pos_mark2, index 
+			index = self.mark2_indexes.get(tokens[pos_mark2], -1)
+			if index >= 0:
+				return pos_mark2, index
 		return -1, -1
 
 	def __str__(self):
@@ -416,18 +1360,40 @@ class ChainPos:
 		self.right = right
 		self.output = output
 
+	def compile(self, font):
+		self.left_keys = coverages_keys(font, self.left)
+		self.input_keys = coverage_keys(font, self.input)
+		self.right_keys = coverages_keys(font, self.right)
+
+	def coverages(self):
+		return self.left_keys + [self.input_keys] + self.right_keys
+
+	def compile_classes(self, coverage_classes):
+		self.left_keys = coverage_classes.share(self.left_keys)
+		self.input_keys = coverage_classes.share([self.input_keys])[0]
+		self.right_keys = coverage_classes.share(self.right_keys)
+		self.left_classes = coverage_classes.classes_of(self.left_keys)
+		self.following_classes = coverage_classes.classes_of([self.input_keys] + self.right_keys)
+
 	def length(self):
 		return len(self.left) + 1 + len(self.right)
 
+	def first_glyphs(self):
+		return coverages_glyphs([self.input_keys])
+
+	def glyphs(self):
+		return coverages_glyphs(self.left_keys + [self.input_keys] + self.right_keys)
+
 	def recur(self):
 		return self.output
 
 	def applicable(self, tokens, pos, font, lookup):
-		return tokens[pos] in self.input and \
-			is_suffix_of(self.left, filter_list(tokens[:pos], \
-				lambda t : filter_glyph(t, font, lookup))) and \
-			is_prefix_of(self.input + self.right, filter_list(tokens[pos:], \
-				lambda t : filter_glyph(t, font, lookup)))
+		class_of = lookup.class_of
+		return class_of[tokens[pos]] in self.following_classes[0] and \
+			classes_match(self.left_classes, tokens, \
+				skip_left(tokens, pos, len(self.left_classes), lookup), class_of) and \
+			classes_match(self.following_classes, tokens, \
+				skip_right(tokens, pos - 1, len(self.following_classes), lookup), class_of)
 
 	def apply(self, tokens, positionings, pos, font, lookup):
 		return positionings
@@ -445,36 +1411,132 @@ class GPOS_Lookup:
 		self.mark_class = 0
 		self.filter_set = None
 		self.positionings = []
-
+		self.compiled = False
+		self.coverage_classes = None
+		self.preceding = None
+		self.adjustment_table = None
+		self.digest = None
+		self.applied = 0
+		self.skipped = 0
+		self.font = None
+
+	# The font owning the lookup, if any, is told of the change.
 	def add_positioning(self, positioning):
 		self.positionings.append(positioning)
+		self.compiled = False
+		if self.font is not None:
+			self.font.changed()
 
 	# Normally one shouldn't use this. The textual order should be the order
 	# in which rules are attempted.
 	def reorder(self):
 		self.positionings = sorted(self.positionings, key=lambda s : s.length())
+		self.compiled = False
+		if self.font is not None:
+			self.font.changed()
 
-	def apply(self, tokens, positionings, font):
-		applications = []
-		for pos in range(len(tokens)):
-			positionings, application = self.apply_at(tokens, positionings, pos, font)
-			if application is not None:
-				applications.append(application)
-		return positionings, applications
+	def compile(self, font):
+		self.skip_mask = skip_mask(font, self)
+		for posit in self.positionings:
+			posit.compile(font)
+		compile_coverage_classes(font, self, \
+			[p for p in self.positionings if isinstance(p, ChainPos)])
+		self.attaches = any(isinstance(p, (MarkBaseAttachment, MarkMarkAttachment)) \
+			for p in self.positionings)
+		self.pairs = len(self.positionings) > 0 and \
+			all(isinstance(p, (PairAdjustment1, PairAdjustment2)) for p in self.positionings)
+		if font.interned and len(self.positionings) > 0 and \
+				all(isinstance(p, SingleAdjustment) for p in self.positionings):
+			self.adjustment_table = AdjustmentTable(font, self.positionings)
+		else:
+			self.adjustment_table = None
+		self.digest = font.glyphs_digest(g for p in self.positionings for g in p.first_glyphs())
+		self.compiled = True
+
+	def glyphs(self):
+		for posit in self.positionings:
+			yield from posit.glyphs()
+
+	# Whether a rule can start at a glyph of a buffer with the digest.
+	def may_apply(self, digest, font):
+		if not self.compiled:
+			self.compile(font)
+		return digests_overlap(self.digest, digest)
+
+	# Glyphs to attach to are found for all positions before the pass. A
+	# pair adjustment that adjusts the second glyph moves past it. Lookups
+	# of pair adjustments are applied to all pairs at once, and lookups of
+	# single adjustments to all glyphs, unless traced.
+	def apply(self, tokens, positionings, font, tracer=None):
+		if not self.compiled:
+			self.compile(font)
+		if self.pairs and font.interned and font.vectorised and tracer is None:
+			return self.apply_pairs(tokens, positionings, font)
+		if self.adjustment_table is not None and font.vectorised and tracer is None:
+			self.adjustment_table.apply(np.asarray(tokens), positionings)
+			return positionings
+		if self.attaches:
+			self.preceding = PrecedingGlyphs(tokens, font, self)
+		pos = 0
+		while pos < len(tokens):
+			positionings, posit = self.apply_at(tokens, positionings, pos, font, tracer)
+			if posit is not None and tracer is not None:
+				tracer.buffer_changed(tokens, positionings)
+			if isinstance(posit, (PairAdjustment1, PairAdjustment2)) and posit.values2 is not None:
+				pos = skip_right(tokens, pos, 1, self)[0]
+			pos += 1
+		self.preceding = None
+		return positionings
+
+	# Pairs of each glyph the lookup does not skip and the next, matched by
+	# every subtable, as arrays. The first subtable that matches a pair
+	# adjusts it.
+	def apply_pairs(self, tokens, positionings, font):
+		glyphs = np.asarray(tokens)
+		unskipped = np.nonzero(np.asarray(self.skip_mask)[glyphs] == 0)[0]
+		firsts = unskipped[:-1]
+		seconds = unskipped[1:]
+		glyphs1 = glyphs[firsts]
+		glyphs2 = glyphs[seconds]
+		subtable = np.full(len(firsts), -1)
+		values1 = new_values(len(firsts))
+		values2 = new_values(len(firsts))
+		for index, posit in enumerate(self.positionings):
+			matched, v1, v2 = posit.match_pairs(glyphs1, glyphs2, len(font.glyphs))
+			new = matched & (subtable < 0)
+			subtable[new] = index
+			values1[new] = v1[new]
+			if v2 is not None:
+				values2[new] = v2[new]
+		matched = subtable >= 0
+		# Pairs that start with the second glyph of a pair whose second
+		# glyph is adjusted are skipped, from left to right.
+		if any(posit.values2 is not None for posit in self.positionings):
+			skipped_to = -1
+			for i in np.nonzero(matched)[0].tolist():
+				if i == skipped_to:
+					matched[i] = False
+				elif self.positionings[subtable[i]].values2 is not None:
+					skipped_to = i + 1
+		add_values(positionings, firsts[matched], values1[matched])
+		add_values(positionings, seconds[matched], values2[matched])
+		return positionings
 
-	def apply_at(self, tokens, positionings, pos, font):
+	def apply_at(self, tokens, positionings, pos, font, tracer=None, depth=0):
+		if not self.compiled:
+			self.compile(font)
 		for posit in sorted(self.positionings, key=lambda s : s.length()):
 			if posit.applicable(tokens, pos, font, self):
+				if tracer is not None:
+					tracer.rule_matched(self, posit, [pos], depth)
 				recur = posit.recur()
 				if recur is not None:
-					recur_lookup = font.GPOS[recur]
-					positionings, application = recur_lookup.apply_at(tokens, positionings, pos, font)
-					application['index'] = str(self.index) + '/' + application['index']
+					recur_lookup = font.GPOS_lookups[recur]
+					positionings, _ = recur_lookup.apply_at(tokens, positionings, pos, font, \
+						tracer, depth + 1)
 				else:
 					positionings = posit.apply(tokens, positionings, pos, font, self)
-					application = {'index': str(self.index), 'posses': [pos], 'rule': posit, \
-						'tokens': tokens, 'positionings': positionings}
-				return positionings, application
+				return positionings, posit
 		return positionings, None
 
 	def __str__(self):
@@ -495,6 +1557,30 @@ class Feature:
 	def __str__(self):
 		return "FEATURE " + self.tag + ' ' + self.lookup_indexes
 
+# Lookups to apply, in order, each with the first feature that is not
+# suppressed among the features that include it. Features are not
+# distinguished by script and language in Font, so all features are
+# considered for any script and language.
+class ShapePlan:
+	def __init__(self, font, script, language, suppressed):
+		self.script = script
+		self.language = language
+		self.suppressed = suppressed
+		self.valid = True
+		self.GSUB_lookups = plan_lookups(font.GSUB_lookup_list, \
+			font.GSUB_lookup_index_to_feature, suppressed)
+		self.GPOS_lookups = plan_lookups(font.GPOS_lookup_list, \
+			font.GPOS_lookup_index_to_feature, suppressed)
+
+def plan_lookups(lookups, index_to_features, suppressed):
+	planned = []
+	for lookup in lookups:
+		for feature in index_to_features.get(lookup.index, []):
+			if feature.tag not in suppressed:
+				planned.append((lookup, feature.tag))
+				break
+	return planned
+
 # Glyph classes (cf. glyph_to_class)
 BASE_GLYPH = 1
 LIGATURE_GLYPH = 2
@@ -549,6 +1635,56 @@ class Font:
 		self.GPOS_lookups = {}
 		self.GPOS_lookup_index_to_feature = {}
 
+		# Glyphs are names, unless interned to indexes in the glyph order
+		self.interned = False
+		self.glyph_ids = {}
+		self.compiled = False
+		self.shape_cache = None
+		self.word_cache = None
+		self.plans = {}
+		self.chain_automata = False
+		self.vectorised = True
+
+	# Attributes of tables not yet read (see read_ttx) are read on first use.
+	def __getattr__(self, attr):
+		lazy_tables = self.__dict__.get('lazy_tables')
+		if lazy_tables is not None and lazy_tables.provides(attr):
+			lazy_tables.load(self, attr)
+			return getattr(self, attr)
+		raise AttributeError(attr)
+
+	# Compiled forms and cached results are outdated.
+	def changed(self):
+		self.compiled = False
+		for plan in self.plans.values():
+			plan.valid = False
+		self.plans = {}
+		if self.shape_cache is not None:
+			self.shape_cache.clear()
+		if self.word_cache is not None:
+			self.word_cache.clear()
+
+	# Keep results of apply and render for the given number of most recent
+	# token sequences and suppressed features; size None for no cache.
+	def set_shape_cache(self, size=1024):
+		self.shape_cache = ShapeCache(size) if size else None
+
+	# Whether lookups with only chaining rules find matches with a
+	# ChainAutomaton (see automaton_differences).
+	def set_chain_automata(self, on=True):
+		self.chain_automata = on
+		self.changed()
+
+	# Whether lookups that allow it are applied to whole buffers with NumPy
+	# (see GPOS_Lookup.apply), rather than position by position.
+	def set_vectorised(self, on=True):
+		self.vectorised = on
+		self.changed()
+
+	# Memo of shaped words for render_words.
+	def set_word_cache(self, size=4096):
+		self.word_cache = ShapeCache(size)
+
 	def set_property(self, section, prop, val):
 		self.properties[section][prop] = str(val)
 
@@ -564,6 +1700,9 @@ class Font:
 
 	def add_glyph(self, name):
 		self.glyphs.append(name)
+		if self.interned and name not in self.glyph_ids:
+			self.glyph_ids[name] = len(self.glyphs) - 1
+		self.changed()
 		if name not in self.width:
 			self.width[name] = 0
 		if name not in self.lsb:
@@ -585,6 +1724,7 @@ class Font:
 			self.glyph_to_class[name] = MARK_GLYPH
 		if name not in self.mark_to_class:
 			self.mark_to_class[name] = 1
+		self.changed()
 
 	def complete_glyph_list(self):
 		name_set = set(self.glyphs)
@@ -605,25 +1745,109 @@ class Font:
 
 	def add_GSUB_feature(self, feature):
 		self.GSUB_features.append(feature)
+		self.changed()
 		for lookup_index in feature.lookup_indexes:
-			self.GSUB_lookup_index_to_feature[lookup_index] = feature
+			self.GSUB_lookup_index_to_feature.setdefault(lookup_index, []).append(feature)
 
 	def add_GSUB_lookup(self, index, lookup):
 		self.GSUB_lookup_list.append(lookup)
 		self.GSUB_lookups[index] = lookup
+		lookup.font = self
+		self.changed()
 
 	def add_GPOS_feature(self, feature):
 		self.GPOS_features.append(feature)
+		self.changed()
 		for lookup_index in feature.lookup_indexes:
-			self.GPOS_lookup_index_to_feature[lookup_index] = feature
+			self.GPOS_lookup_index_to_feature.setdefault(lookup_index, []).append(feature)
 
 	def add_GPOS_lookup(self, index, lookup):
 		self.GPOS_lookup_list.append(lookup)
 		self.GPOS_lookups[index] = lookup
+		lookup.font = self
+		self.changed()
 
 	def string_to_tokens(self, s):
 		return [self.charset_total[ord(c)] for c in s]
 
+	# From now on, glyphs in token buffers are indexes in the glyph order.
+	def intern_glyphs(self):
+		self.glyph_ids = {}
+		for i, name in enumerate(self.glyphs):
+			if name not in self.glyph_ids:
+				self.glyph_ids[name] = i
+		self.interned = True
+		self.changed()
+
+	def glyph_key(self, name):
+		return self.glyph_ids[name] if self.interned else name
+
+	def glyph_name(self, key):
+		return self.glyphs[key] if self.interned else key
+
+	def tokens_to_buffer(self, tokens):
+		if self.interned:
+			return array('H', [self.glyph_ids[t] for t in tokens])
+		else:
+			return list(tokens)
+
+	def buffer_to_tokens(self, buffer):
+		return [self.glyph_name(key) for key in buffer]
+
+	# Table indexed by glyph key, with default for glyphs not in values.
+	# Values must fit in the array typecode, by default a byte.
+	def glyph_table(self, values, default, typecode='B'):
+		if self.interned:
+			table = array(typecode, [default]) * len(self.glyphs)
+		else:
+			table = GlyphTable(default)
+		for glyph, value in values.items():
+			table[glyph] = value
+		return table
+
+	# GDEF and rules keyed by glyph names or by glyph indexes.
+	def compile(self):
+		def known(name):
+			return not self.interned or name in self.glyph_ids
+		classes = {self.glyph_key(g): cl for g, cl in self.glyph_to_class.items() if known(g)}
+		mark_classes = {self.glyph_key(g): cl for g, cl in self.mark_to_class.items() if known(g)}
+		self.class_of = self.glyph_table(classes, 0)
+		self.mark_class_of = self.glyph_table(mark_classes, 0)
+		self.classified_glyphs = set(classes).union(mark_classes)
+		self.mark_sets = {index: frozenset(self.glyph_key(g) for g in glyphs if known(g)) \
+			for index, glyphs in self.index_to_glyphs.items()}
+		if self.interned:
+			self.advance_table = np.array([self.width.get(g, 0) for g in self.glyphs], dtype=np.int64)
+		else:
+			self.glyph_digests = GlyphTable(ALL_GLYPHS_DIGEST)
+			for i, name in enumerate(self.glyphs):
+				self.glyph_digests.setdefault(name, glyph_digest(i))
+		self.rule_glyphs = set()
+		self.word_breaks = {}
+		for lookup in self.GSUB_lookup_list:
+			lookup.compile(self)
+			self.rule_glyphs.update(lookup.glyphs())
+		for lookup in self.GPOS_lookup_list:
+			lookup.compile(self)
+			self.rule_glyphs.update(lookup.glyphs())
+		self.compiled = True
+
+	# Whether no lookup can look across the glyph, so that the text before and
+	# after can be shaped separately: no rule matches or produces it, no lookup
+	# skips it, and it is a base glyph, at which marks stop looking for their
+	# base.
+	def is_word_break(self, glyph):
+		if not self.compiled:
+			self.compile()
+		if glyph not in self.word_breaks:
+			self.word_breaks[glyph] = glyph not in self.rule_glyphs and \
+				not any(lookup.skip_mask[glyph] for lookup in self.GSUB_lookup_list) and \
+				not any(lookup.skip_mask[glyph] for lookup in self.GPOS_lookup_list) and \
+				(self.class_of[glyph] == BASE_GLYPH or \
+					not any(isinstance(posit, MarkBaseAttachment) \
+						for lookup in self.GPOS_lookup_list for posit in lookup.positionings))
+		return self.word_breaks[glyph]
+
 	def new_GSUB_lookup(self, t, feat=None):
 		index = str(len(self.GSUB_lookup_list))
 		lookup = GSUB_Lookup(index, t)
@@ -632,45 +1856,189 @@ class Font:
 			feat.add_lookup_index(index)
 		return lookup
 
-	def apply(self, tokens, suppressed=[]):
-		applications = []
-		for lookup in self.GSUB_lookup_list:
-			if lookup.index in self.GSUB_lookup_index_to_feature:
-				tag = self.GSUB_lookup_index_to_feature[lookup.index].tag
-				if tag not in suppressed:
-					tokens, applications_lookup = lookup.apply(tokens, self)
-					for a in applications_lookup:
-						a['feature'] = tag
-						applications.append(a)
-		positionings = [{} for t in tokens]
-		for lookup in self.GPOS_lookup_list:
-			if lookup.index in self.GPOS_lookup_index_to_feature:
-				tag = self.GPOS_lookup_index_to_feature[lookup.index].tag
-				if tag not in suppressed:
-					positionings, applications_lookup = lookup.apply(tokens, positionings, self)
-					for a in applications_lookup:
-						a['feature'] = tag
-						applications.append(a)
+	# Plan for suppressed features, made once until the font changes.
+	def shape_plan(self, suppressed=[], script=None, language=None):
+		if not self.compiled:
+			self.compile()
+		key = (self.script if script is None else script, language, frozenset(suppressed))
+		if key not in self.plans:
+			self.plans[key] = ShapePlan(self, *key)
+		return self.plans[key]
+
+	# Applications of rules are recorded only if trace is set. The tracer, if
+	# any, is told about every lookup, match and change (see Tracer).
+	# A plan, if given, replaces suppressed.
+	def apply(self, tokens, suppressed=[], trace=True, tracer=None, plan=None):
+		plan = self.valid_plan(plan, suppressed)
+		if self.shape_cache is not None and tracer is None:
+			return self.shape_cache.render(self, tokens, plan, False, trace)[:3]
+		return self.apply_lookups(tokens, plan, trace, tracer)
+
+	def valid_plan(self, plan, suppressed):
+		if plan is None:
+			return self.shape_plan(suppressed)
+		elif not plan.valid:
+			return self.shape_plan(plan.suppressed, plan.script, plan.language)
+		else:
+			return plan
+
+	def apply_lookups(self, tokens, plan, trace=True, tracer=None):
+		if not self.compiled:
+			self.compile()
+		if trace:
+			tracer = ApplicationRecorder(tracer)
+		if tracer is not None:
+			tracer.buffer_started(tokens)
+		buffer = GlyphBuffer(tokens)
+		for lookup, tag in plan.GSUB_lookups:
+			if tracer is not None:
+				tracer.lookup_entered(lookup, tag)
+			if lookup.may_apply(buffer.digest(self), self):
+				lookup.applied += 1
+				lookup.apply(buffer, self, tracer)
+			else:
+				lookup.skipped += 1
+		digest = buffer.digest(self)
+		tokens = buffer.glyphs()
+		positionings = new_positionings(len(tokens))
+		for lookup, tag in plan.GPOS_lookups:
+			if tracer is not None:
+				tracer.lookup_entered(lookup, tag)
+			if lookup.may_apply(digest, self):
+				lookup.applied += 1
+				positionings = lookup.apply(tokens, positionings, self, tracer)
+			else:
+				lookup.skipped += 1
+		applications = tracer.applications if trace else []
 		return tokens, positionings, applications
 
+	# Digest of glyphs, by their index in the glyph order. Glyphs not in the
+	# glyph order may be in any set.
+	def glyphs_digest(self, glyphs):
+		digest = 0
+		if self.interned:
+			for glyph in set(glyphs):
+				digest |= glyph_digest(glyph)
+		else:
+			glyph_digests = self.glyph_digests
+			for glyph in set(glyphs):
+				digest |= glyph_digests[glyph]
+		return digest
+
+	# Advance widths of the glyphs in a buffer.
+	def advances(self, tokens):
+		if not self.compiled:
+			self.compile()
+		if self.interned:
+			return self.advance_table[np.asarray(tokens)]
+		else:
+			return np.array([self.width.get(t, 0) for t in tokens], dtype=np.int64)
+
+	# Places of glyphs, from the origin of the first. The pen moves by the
+	# advance widths, adjusted by XAdvance, of glyphs that are not attached.
+	# Glyphs are moved by their placements, and attached glyphs are placed
+	# from the glyph they are attached to, which comes before them.
 	def shape(self, tokens, positionings):
-		places = [(0,0)]
-		x_ref = self.width[tokens[0]]
-		y_ref = 0
-		x = 0
-		y = 0
-		for pos in positionings[1:]:
-			if 'XCoordinate' in pos:
-				x = x + pos['XCoordinate']
-			if 'YCoordinate' in pos:
-				y = y + pos['YCoordinate']
-			places.append((-x_ref + x, y_ref + y))
-		return places
-
-	def render(self, tokens, suppressed=[]):
-		tokens, positionings, applications = self.apply(tokens, suppressed=suppressed)
+		if len(tokens) == 0:
+			return []
+		advances = self.advances(tokens) + positionings['XAdvance']
+		attach = positionings['Attach']
+		attached = attach.nonzero()[0]
+		advances[attached] = 0
+		x = np.add.accumulate(advances) - advances + positionings['XPlacement']
+		y = positionings['YPlacement'].astype(np.int64)
+		if len(attached) > 0:
+			anchors = attached + attach[attached]
+			dx = positionings['XCoordinate'][attached] + positionings['XPlacement'][attached]
+			dy = positionings['YCoordinate'][attached] + positionings['YPlacement'][attached]
+			# As many rounds as attachments in the longest chain to a glyph
+			# that is not attached.
+			ancestors = anchors
+			while True:
+				x[attached] = x[anchors] + dx
+				y[attached] = y[anchors] + dy
+				up = attach[ancestors]
+				if not up.any():
+					break
+				ancestors = ancestors + up
+		return list(zip(x.tolist(), y.tolist()))
+
+	def render(self, tokens, suppressed=[], trace=True, tracer=None, plan=None):
+		plan = self.valid_plan(plan, suppressed)
+		if self.shape_cache is not None and tracer is None:
+			return self.shape_cache.render(self, tokens, plan, True, trace)
+		tokens, positionings, applications = self.apply_lookups(tokens, plan, trace, tracer)
 		return tokens, positionings, applications, self.shape(tokens, positionings)
 
+	# As render, but words between break glyphs are shaped separately, each
+	# distinct word only once (see set_word_cache). Break glyphs that are not
+	# word breaks (see is_word_break) are ignored. Gives the same tokens,
+	# positionings and places as render, without applications.
+	def render_words(self, tokens, suppressed=[], breaks=['space']):
+		if self.word_cache is None:
+			self.set_word_cache()
+		plan = self.shape_plan(suppressed)
+		break_keys = set()
+		for name in breaks:
+			if name in self.width and (not self.interned or name in self.glyph_ids):
+				key = self.glyph_key(name)
+				if self.is_word_break(key):
+					break_keys.add(key)
+		shaped = tokens[:0]
+		positionings = []
+		start = 0
+		for pos in range(len(tokens) + 1):
+			if pos == len(tokens) or tokens[pos] in break_keys:
+				if pos > start:
+					word_tokens, word_positionings, _, _ = \
+						self.word_cache.entry(self, tokens[start:pos], plan, False)
+					shaped.extend(word_tokens)
+					positionings.append(word_positionings)
+				if pos < len(tokens):
+					shaped.append(tokens[pos])
+					positionings.append(new_positionings(1))
+				start = pos + 1
+		positionings = np.concatenate(positionings) if len(positionings) > 0 else new_positionings(0)
+		places = self.shape(shaped, positionings)
+		return shaped, positionings, places
+
+	# Glyph names and places of shaped string.
+	def shape_string(self, string, suppressed=[]):
+		buffer = self.tokens_to_buffer(self.string_to_tokens(string))
+		tokens, _, _, places = self.render(buffer, suppressed=suppressed, trace=False)
+		return self.buffer_to_tokens(tokens), places
+
+	# Lazily shape many strings, as shape_string, with results in the order of
+	# the strings. With several workers, chunks of strings are shaped by a
+	# pool of processes sharing the font, with a bounded number of chunks
+	# in progress, so that strings can come from a large file.
+	def shape_many(self, strings, suppressed=[], workers=None, chunksize=64):
+		if workers is None:
+			workers = os.cpu_count() or 1
+		if workers <= 1:
+			for string in strings:
+				yield self.shape_string(string, suppressed=suppressed)
+			return
+		self.compile()
+		strings = iter(strings)
+		pool = multiprocessing.Pool(workers, initializer=init_shape_worker, \
+			initargs=(self, suppressed))
+		try:
+			pending = deque()
+			while True:
+				while len(pending) < 2 * workers:
+					chunk = list(itertools.islice(strings, chunksize))
+					if len(chunk) == 0:
+						break
+					pending.append(pool.apply_async(shape_chunk, (chunk,)))
+				if len(pending) == 0:
+					break
+				for result in pending.popleft().get():
+					yield result
+		finally:
+			pool.terminate()
+			pool.join()
+
 	def __str__(self):
 		s = ''
 		for feature in self.GSUB_features:
@@ -683,6 +2051,285 @@ class Font:
 			s += lookup
 		return s
 
+# Callbacks during Font.apply. Lookups of features that are not suppressed
+# are entered in order. Matches of rules are reported with depth 0, and
+# matches of lookups applied by those rules with greater depth. After each
+# match at depth 0, the buffer is given, with positionings during GPOS.
+class Tracer:
+	def buffer_started(self, tokens):
+		pass
+
+	def lookup_entered(self, lookup, feature):
+		pass
+
+	def rule_matched(self, lookup, rule, posses, depth):
+		pass
+
+	def buffer_changed(self, tokens, positionings):
+		pass
+
+# Records applications as dictionaries with feature, lookup index (with
+# indexes of applied lookups after slashes), matched positions, rule and
+# buffer after the application. Events are passed on to tracer, if any.
+class ApplicationRecorder(Tracer):
+	def __init__(self, tracer=None):
+		self.tracer = tracer
+		self.applications = []
+		self.feature = None
+		self.tokens = None
+		self.version = None
+
+	def buffer_started(self, tokens):
+		if self.tracer is not None:
+			self.tracer.buffer_started(tokens)
+
+	def lookup_entered(self, lookup, feature):
+		self.feature = feature
+		if self.tracer is not None:
+			self.tracer.lookup_entered(lookup, feature)
+
+	def rule_matched(self, lookup, rule, posses, depth):
+		if depth == 0:
+			self.applications.append({'index': str(lookup.index), 'posses': posses, 'rule': rule, \
+				'feature': self.feature})
+		else:
+			self.applications[-1]['index'] += '/' + str(lookup.index)
+		if self.tracer is not None:
+			self.tracer.rule_matched(lookup, rule, posses, depth)
+
+	# Substitutions change the buffer in place, which is copied unless
+	# unchanged since the previous copy.
+	def buffer_changed(self, tokens, positionings):
+		application = self.applications[-1]
+		if positionings is None:
+			if tokens.version != self.version:
+				self.tokens = tokens[:]
+				self.version = tokens.version
+			application['tokens'] = self.tokens
+		else:
+			application['tokens'] = tokens
+			application['positionings'] = copy_positionings(positionings)
+		if self.tracer is not None:
+			self.tracer.buffer_changed(tokens, positionings)
+
+# Records steps as edits of the buffer: the glyphs removed and inserted at
+# a position, and for GPOS the positionings that changed. The full buffer is
+# kept as checkpoint before every n-th step, from which the buffer at any
+# step is rebuilt.
+class StepTrace(Tracer):
+	def __init__(self, checkpoint_every=64):
+		self.checkpoint_every = checkpoint_every
+		self.buffer_started([])
+
+	def buffer_started(self, tokens):
+		self.steps = []
+		self.checkpoints = []
+		self.current_tokens = tokens[:]
+		self.current_positionings = None
+		self.feature = None
+		self.version = 0
+
+	def lookup_entered(self, lookup, feature):
+		self.feature = feature
+
+	def rule_matched(self, lookup, rule, posses, depth):
+		if depth == 0:
+			self.step = {'feature': self.feature, 'index': str(lookup.index), \
+				'posses': posses, 'rule': rule}
+		else:
+			self.step['index'] += '/' + str(lookup.index)
+
+	def buffer_changed(self, tokens, positionings):
+		if len(self.steps) % self.checkpoint_every == 0:
+			positionings_copy = copy_positionings(self.current_positionings) \
+				if self.current_positionings is not None else None
+			self.checkpoints.append((self.current_tokens[:], positionings_copy))
+		start = 0
+		end_old = len(self.current_tokens)
+		end_new = len(tokens)
+		if positionings is not None or tokens.version == self.version:
+			start = end_old
+		self.version = getattr(tokens, 'version', None)
+		while start < min(end_old, end_new) and self.current_tokens[start] == tokens[start]:
+			start += 1
+		while end_old > start and end_new > start and self.current_tokens[end_old-1] == tokens[end_new-1]:
+			end_old -= 1
+			end_new -= 1
+		self.step['edit'] = (start, self.current_tokens[start:end_old], tokens[start:end_new])
+		self.current_tokens[start:end_old] = tokens[start:end_new]
+		if positionings is not None:
+			if self.current_positionings is None:
+				self.current_positionings = new_positionings(len(tokens))
+			changed = np.nonzero(positionings != self.current_positionings)[0]
+			self.current_positionings[changed] = positionings[changed]
+			self.step['positionings'] = (changed, positionings[changed])
+		self.steps.append(self.step)
+
+	def n_steps(self):
+		return len(self.steps)
+
+	# Step as application (cf. ApplicationRecorder), with buffer after the step.
+	def step_at(self, index):
+		n = self.checkpoint_every
+		tokens, positionings = self.checkpoints[index // n]
+		tokens = tokens[:]
+		positionings = copy_positionings(positionings) if positionings is not None else None
+		for step in self.steps[index // n * n:index + 1]:
+			tokens, positionings = self.redo(step, tokens, positionings)
+		return self.application(self.steps[index], tokens, positionings)
+
+	# All steps in order, rebuilding buffers incrementally.
+	def applications(self):
+		if len(self.steps) == 0:
+			return
+		tokens, positionings = self.checkpoints[0]
+		tokens = tokens[:]
+		positionings = copy_positionings(positionings) if positionings is not None else None
+		for step in self.steps:
+			tokens, positionings = self.redo(step, tokens, positionings)
+			yield self.application(step, tokens[:], copy_positionings(positionings) \
+				if positionings is not None else None)
+
+	def redo(self, step, tokens, positionings):
+		start, removed, inserted = step['edit']
+		tokens[start:start+len(removed)] = inserted
+		if 'positionings' in step:
+			if positionings is None:
+				positionings = new_positionings(len(tokens))
+			changed, values = step['positionings']
+			positionings[changed] = values
+		return tokens, positionings
+
+	def application(self, step, tokens, positionings):
+		application = {'feature': step['feature'], 'index': step['index'], \
+			'posses': step['posses'], 'rule': step['rule'], 'tokens': tokens}
+		if 'positionings' in step:
+			application['positionings'] = positionings
+		return application
+
+# Results of Font.apply and Font.render, least recently used dropped first.
+# Cleared by Font.changed, also when rules are added to lookups of the font.
+class ShapeCache:
+	def __init__(self, size):
+		self.size = size
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def clear(self):
+		self.entries.clear()
+
+	# Tokens, positionings, applications (or None if not traced) and places
+	# (or None if not yet computed), not to be changed by the caller.
+	def entry(self, font, tokens, plan, trace):
+		key = (tuple(tokens), plan.script, plan.language, plan.suppressed)
+		entry = self.entries.get(key)
+		if entry is None or (trace and entry[2] is None):
+			self.misses += 1
+			tokens_out, positionings, applications = font.apply_lookups(tokens, plan, trace)
+			entry = [tokens_out, positionings, applications if trace else None, None]
+			self.entries[key] = entry
+			self.entries.move_to_end(key)
+			if len(self.entries) > self.size:
+				self.entries.popitem(last=False)
+				self.evictions += 1
+		else:
+			self.hits += 1
+			self.entries.move_to_end(key)
+		return entry
+
+	# Places are only computed when rendering.
+	def render(self, font, tokens, plan, with_places, trace):
+		entry = self.entry(font, tokens, plan, trace)
+		tokens, positionings, applications, places = entry
+		if with_places and places is None:
+			places = font.shape(tokens, positionings)
+			entry[3] = places
+		applications = [copy_application(a) for a in applications] if trace else []
+		return copy_tokens(tokens), copy_positionings(positionings), \
+			applications, list(places) if with_places else None
+
+	def stats(self):
+		lookups = self.hits + self.misses
+		return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses, \
+			'evictions': self.evictions, 'hit_rate': self.hits / lookups if lookups else 0}
+
+def copy_tokens(tokens):
+	return tokens[:]
+
+def copy_positionings(positionings):
+	return positionings.copy()
+
+def copy_application(a):
+	copy = dict(a)
+	copy['tokens'] = copy_tokens(a['tokens'])
+	copy['posses'] = list(a['posses'])
+	if 'positionings' in a:
+		copy['positionings'] = copy_positionings(a['positionings'])
+	return copy
+
+# Indexes of lookups with automata that give other results than trying rules
+# one by one, on random buffers of glyphs from the rules and some others.
+def automaton_differences(font, n=1000, length=20, seed=0):
+	rand = random.Random(seed)
+	if not font.compiled:
+		font.compile()
+	others = [font.glyph_key(g) for g in font.glyphs]
+	differences = []
+	for lookup in font.GSUB_lookup_list:
+		automaton = lookup.automaton
+		if automaton is None:
+			continue
+		glyphs = list(set(lookup.glyphs())) + rand.sample(others, min(len(others), 10))
+		for i in range(n):
+			tokens = font.tokens_to_buffer([font.glyph_name(rand.choice(glyphs)) \
+				for j in range(rand.randint(1, length))])
+			with_automaton = GlyphBuffer(tokens)
+			lookup.apply(with_automaton, font)
+			lookup.automaton = None
+			without_automaton = GlyphBuffer(tokens)
+			lookup.apply(without_automaton, font)
+			lookup.automaton = automaton
+			if with_automaton.glyphs() != without_automaton.glyphs():
+				differences.append(lookup.index)
+				break
+	return differences
+
+# Classes of the coverages of chaining rules, by lookup, as in
+# CoverageClasses.stats.
+def coverage_class_stats(font):
+	if not font.compiled:
+		font.compile()
+	stats = {}
+	for table, lookups in [('GSUB', font.GSUB_lookup_list), ('GPOS', font.GPOS_lookup_list)]:
+		for lookup in lookups:
+			if lookup.coverage_classes is not None:
+				stats[(table, lookup.index)] = lookup.coverage_classes.stats()
+	return stats
+
+# Lookups applied and skipped because no glyph of the buffer can start a
+# rule, by lookup, as counted since the lookups were made.
+def digest_stats(font):
+	stats = {}
+	for table, lookups in [('GSUB', font.GSUB_lookup_list), ('GPOS', font.GPOS_lookup_list)]:
+		for lookup in lookups:
+			if lookup.applied + lookup.skipped > 0:
+				stats[(table, lookup.index)] = {'applied': lookup.applied, 'skipped': lookup.skipped}
+	return stats
+
+# Font and suppressed features of process in pool of shape_many.
+worker_font = None
+worker_suppressed = []
+
+def init_shape_worker(font, suppressed):
+	global worker_font, worker_suppressed
+	worker_font = font
+	worker_suppressed = suppressed
+
+def shape_chunk(strings):
+	return [worker_font.shape_string(s, suppressed=worker_suppressed) for s in strings]
+
 data_dir = 'data'
 
 def starter_font():
@@ -696,20 +2343,26 @@ def starter_font():
 	read_basic_properties(os.path.join(data_dir, 'standard_vhea.xml'), 'vhea', font)
 	return font
 
-class Simulator:
-	def __init__(self, font):
+class Simulator(StepTrace):
+	def __init__(self, font, checkpoint_every=64):
+		StepTrace.__init__(self, checkpoint_every)
 		self.font = font
 		self.suppressed = []
+		self.plan = None
 		self.in_tokens = []
 		self.tokens = []
-		self.positionings = []
-		self.applications = []
+		self.positionings = new_positionings(0)
 		self.places = []
 
+	# The plan is kept until suppressed or the font changes.
 	def set_tokens(self, tokens):
 		self.in_tokens = tokens
-		self.tokens, self.positionings, self.applications, self.places = \
-			self.font.render(tokens, suppressed=self.suppressed)
+		if self.plan is None or not self.plan.valid or \
+				self.plan.suppressed != frozenset(self.suppressed):
+			self.plan = self.font.shape_plan(self.suppressed)
+		self.tokens, self.positionings, _, self.places = \
+			self.font.render(self.font.tokens_to_buffer(tokens), trace=False, tracer=self, \
+				plan=self.plan)
 
 	def set_string(self, string):
 		self.in_tokens = self.font.string_to_tokens(string)
@@ -720,28 +2373,30 @@ class Simulator:
 		
 	def steps_str(self):
 		s = ''
-		for a in self.applications:
+		for a in self.applications():
 			s += 'feature: {}, lookup: {}, pos: {}'.format(a['feature'], a['index'], \
 				','.join([str(p) for p in a['posses']])) + '\n'
 			if 'positionings' not in a:
 				s += str(a['rule']) + '\n'
-				tokens_copy = a['tokens'].copy()
+				tokens_copy = self.font.buffer_to_tokens(a['tokens'])
 				tokens_copy.insert(a['posses'][0], '>')
 				s += ' '.join(tokens_copy) + '\n'
 			else:
-				for index, (t, p) in enumerate(zip(a['tokens'], a['positionings'])):
+				tokens = self.font.buffer_to_tokens(a['tokens'])
+				for index, (t, p) in enumerate(zip(tokens, a['positionings'])):
 					if index == a['posses'][0]:
 						s += '> '
-					if len(p) == 0:
+					items = positioning_items(p)
+					if len(items) == 0:
 						s += t + ' '
 					else:
-						s += t + '(' + str(p.items()) + ')\n'
+						s += t + '(' + ', '.join(f + '=' + str(v) for f, v in items) + ')\n'
 				s += '\n'
 			s += '\n'
 		return s
 
 	def shaped_str(self):
 		s = 'Shaped\n'
-		for t, p in zip(self.tokens, self.places):
+		for t, p in zip(self.font.buffer_to_tokens(self.tokens), self.places):
 			s += t + str(p) + ' '
 		return s
@@ -1,11 +1,16 @@
+import numpy as np
 from lxml import etree
 
 from ttxfont import Font, Feature, \
 	GSUB_Lookup, SingleSubstitution1, MultSubstitution, LigSubstitution, ChainSubstitution3, \
-	GPOS_Lookup, SingleAdjustment, MarkBaseAttachment, MarkMarkAttachment, ChainPos
+	ChainClassRule, ChainSubstitution2, ReverseSubstitution, \
+	GPOS_Lookup, SingleAdjustment, PairAdjustment1, PairAdjustment2, MarkBaseAttachment, \
+	MarkMarkAttachment, ChainPos, new_values, set_value
 
 def read_properties(doc, prop_name, font):
-	elem = doc.find(prop_name)
+	read_properties_table(doc.find(prop_name), prop_name, font)
+
+def read_properties_table(elem, prop_name, font):
 	for sub_elem in elem.findall('*'):
 		if sub_elem.tag is None:
 			None
@@ -91,47 +96,50 @@ def read_post(elem, font):
 
 def read_glyf(elem, font):
 	for glyph_elem in elem.findall('TTGlyph'):
-		name = glyph_elem.get('name')
-		if 'xMin' in glyph_elem.attrib:
-			font.xmin[name] = int(glyph_elem.get('xMin'))
-		if glyph_elem.get('yMin') is not None:
-			font.ymin[name] = int(glyph_elem.get('yMin'))
-		if glyph_elem.get('xMax') is not None:
-			font.xmax[name] = int(glyph_elem.get('xMax'))
-		if glyph_elem.get('yMax') is not None:
-			font.ymax[name] = int(glyph_elem.get('yMax'))
-		contours = []
-		for contour_elem in glyph_elem.findall('contour'):
-			contour = []
-			for pt_elem in contour_elem:
-				pt = (pt_elem.get('x'), pt_elem.get('y'), pt_elem.get('on'))
-				contour.append(pt)
-			contours.append(contour)
-		font.contours[name] = contours
-		components = []
-		for component_elem in glyph_elem.findall('component'):
-			glyphName = component_elem.get('glyphName')
-			x = component_elem.get('x')
-			y = component_elem.get('y')
-			scale = component_elem.get('scale')
-			scalex = component_elem.get('scalex')
-			scaley = component_elem.get('scaley')
-			scale01 = component_elem.get('scale01')
-			scale10 = component_elem.get('scale10')
-			flags = component_elem.get('flags')
-			component = {'glyphName': glyphName, 'x': x, 'y': y, 'flags': flags}
-			if scale is not None:
-				component['scale'] = scale
-			if scalex is not None:
-				component['scalex'] = scalex
-			if scaley is not None:
-				component['scaley'] = scaley
-			if scale01 is not None:
-				component['scale01'] = scale01
-			if scale10 is not None:
-				component['scale10'] = scale10
-			components.append(component)
-		font.components[name] = components
+		read_TTGlyph(glyph_elem, font)
+
+def read_TTGlyph(glyph_elem, font):
+	name = glyph_elem.get('name')
+	if 'xMin' in glyph_elem.attrib:
+		font.xmin[name] = int(glyph_elem.get('xMin'))
+	if glyph_elem.get('yMin') is not None:
+		font.ymin[name] = int(glyph_elem.get('yMin'))
+	if glyph_elem.get('xMax') is not None:
+		font.xmax[name] = int(glyph_elem.get('xMax'))
+	if glyph_elem.get('yMax') is not None:
+		font.ymax[name] = int(glyph_elem.get('yMax'))
+	contours = []
+	for contour_elem in glyph_elem.findall('contour'):
+		contour = []
+		for pt_elem in contour_elem:
+			pt = (pt_elem.get('x'), pt_elem.get('y'), pt_elem.get('on'))
+			contour.append(pt)
+		contours.append(contour)
+	font.contours[name] = contours
+	components = []
+	for component_elem in glyph_elem.findall('component'):
+		glyphName = component_elem.get('glyphName')
+		x = component_elem.get('x')
+		y = component_elem.get('y')
+		scale = component_elem.get('scale')
+		scalex = component_elem.get('scalex')
+		scaley = component_elem.get('scaley')
+		scale01 = component_elem.get('scale01')
+		scale10 = component_elem.get('scale10')
+		flags = component_elem.get('flags')
+		component = {'glyphName': glyphName, 'x': x, 'y': y, 'flags': flags}
+		if scale is not None:
+			component['scale'] = scale
+		if scalex is not None:
+			component['scalex'] = scalex
+		if scaley is not None:
+			component['scaley'] = scaley
+		if scale01 is not None:
+			component['scale01'] = scale01
+		if scale10 is not None:
+			component['scale10'] = scale10
+		components.append(component)
+	font.components[name] = components
 
 def read_COLR(elem, font):
 	if elem is not None:
@@ -145,23 +153,26 @@ def read_COLR(elem, font):
 			font.color_layers[glyph_name] = layers
 
 def read_GlyphClassDef(elem, font):
-	for def_elem in elem.findall('ClassDef'):
-		glyph = def_elem.get('glyph')
-		cl = int(def_elem.get('class'))
-		font.glyph_to_class[glyph] = cl
+	if elem is not None:
+		for def_elem in elem.findall('ClassDef'):
+			glyph = def_elem.get('glyph')
+			cl = int(def_elem.get('class'))
+			font.glyph_to_class[glyph] = cl
 	
 def read_MarkAttachClassDef(elem, font):
-	for def_elem in elem.findall('ClassDef') :
-		glyph = def_elem.get('glyph')
-		cl = int(def_elem.get('class'))
-		font.mark_to_class[glyph] = cl
+	if elem is not None:
+		for def_elem in elem.findall('ClassDef') :
+			glyph = def_elem.get('glyph')
+			cl = int(def_elem.get('class'))
+			font.mark_to_class[glyph] = cl
 
 def read_MarkGlyphSetsDef(elem, font):
-	for coverage_elem in elem.findall('Coverage'):
-		index = int(coverage_elem.get('index'))
-		glyph_elems = coverage_elem.findall('Glyph')
-		glyphs = [g.get('value') for g in glyph_elems]
-		font.index_to_glyphs[index] = glyphs
+	if elem is not None:
+		for coverage_elem in elem.findall('Coverage'):
+			index = int(coverage_elem.get('index'))
+			glyph_elems = coverage_elem.findall('Glyph')
+			glyphs = [g.get('value') for g in glyph_elems]
+			font.index_to_glyphs[index] = glyphs
 
 def read_coverage(cov):
 	tokens = []
@@ -169,8 +180,15 @@ def read_coverage(cov):
 		tokens.append(glyph_elem.get('value'))
 	return tokens
 
+def read_class_def(elem):
+	if elem is None:
+		return {}
+	return {def_elem.get('glyph'): int(def_elem.get('class')) for def_elem in elem.findall('ClassDef')}
+
 def read_flag(elem, lookup):
-	flag = int(elem.get('value'))
+	set_flag(int(elem.get('value')), lookup)
+
+def set_flag(flag, lookup):
 	# https://learn.microsoft.com/en-us/typography/opentype/otspec160/chapter2
 	right_to_left = bool(flag & 1) # only for GPOS Type 3
 	lookup.ignore_base_glyphs = bool(flag & 2) # skips over base glyphs
@@ -189,7 +207,9 @@ def read_single_subst(single, lookup):
 def read_mult_subst(mult, lookup):
 	# Type 2: Replace one glyph with more than one glyph
 	for sub_elem in mult.findall('Substitution'):
-		sub = MultSubstitution(sub_elem.get('in'), sub_elem.get('out').split(','))
+		out_str = sub_elem.get('out')
+		outputs = [] if out_str == '' else out_str.split(',')
+		sub = MultSubstitution(sub_elem.get('in'), outputs)
 		lookup.add(sub)
 
 def read_ligature_subst(lig, lookup):
@@ -223,7 +243,55 @@ def read_chain_subst3(chain, lookup):
 			refs.append((seq_index, lookup_index))
 		else:
 			print('Unexpected in ChainContextSubst', child)
-	sub = ChainSubstitution3(lefts, inputs, rights, refs)
+	# The backtrack is stored from the glyph before the input backward.
+	sub = ChainSubstitution3(lefts[::-1], inputs, rights, refs)
+	lookup.add(sub)
+
+def read_chain_rule(rule, read_value):
+	# Glyphs or classes of a rule of Format 1 or 2, without the first input
+	lefts = []
+	inputs = []
+	rights = []
+	refs = []
+	for child in rule.findall('*'):
+		if child.tag == 'Backtrack':
+			lefts.append(read_value(child.get('value')))
+		elif child.tag == 'Input':
+			inputs.append(read_value(child.get('value')))
+		elif child.tag == 'LookAhead':
+			rights.append(read_value(child.get('value')))
+		elif child.tag == 'SubstLookupRecord':
+			seq_index = int(child.find('SequenceIndex').get('value'))
+			lookup_index = int(child.find('LookupListIndex').get('value'))
+			refs.append((seq_index, lookup_index))
+		else:
+			print('Unexpected in ' + rule.tag, child)
+	return lefts[::-1], inputs, rights, refs
+
+def read_chain_subst1(chain, lookup):
+	# Type 6, Format 1: Replace one or more glyphs in chained context of
+	# glyphs, with rule sets by first glyph
+	firsts = read_coverage(chain.find('Coverage'))
+	for rule_set in chain.findall('ChainSubRuleSet'):
+		first = firsts[int(rule_set.get('index'))]
+		for rule in rule_set.findall('ChainSubRule'):
+			lefts, inputs, rights, refs = read_chain_rule(rule, str)
+			lookup.add(ChainSubstitution3(lefts, [first] + inputs, rights, refs))
+
+def read_chain_subst2(chain, lookup):
+	# Type 6, Format 2: Replace one or more glyphs in chained context of
+	# classes, with rule sets by class of first glyph
+	coverage = read_coverage(chain.find('Coverage'))
+	rule_sets = []
+	for rule_set in chain.findall('ChainSubClassSet'):
+		cl = int(rule_set.get('index'))
+		rule_sets.extend([] for _ in range(cl + 1 - len(rule_sets)))
+		for rule in rule_set.findall('ChainSubClassRule'):
+			lefts, inputs, rights, refs = read_chain_rule(rule, int)
+			rule_sets[cl].append(ChainClassRule(lefts, [cl] + inputs, rights, refs))
+	sub = ChainSubstitution2(coverage, read_class_def(chain.find('BacktrackClassDef')), \
+		read_class_def(chain.find('InputClassDef')), \
+		read_class_def(chain.find('LookAheadClassDef')), rule_sets)
 	lookup.add(sub)
 
 def read_reverse_subst(reverse, lookup):
@@ -232,7 +300,7 @@ def read_reverse_subst(reverse, lookup):
 	inputs = []
 	rights = []
 	outputs = []
-	for child in chain.findall('*'):
+	for child in reverse.findall('*'):
 		if child.tag == 'BacktrackCoverage':
 			lefts.append(read_coverage(child))
 		elif child.tag == 'Coverage':
@@ -243,8 +311,8 @@ def read_reverse_subst(reverse, lookup):
 			outputs.append(child.get('value'))
 		else:
 			print('Unexpected in ReverseChainSingleSubst', child)
-	sub = ReverseSubstitution(lefts, input, rights, output)
-	lookup.add_substitution(sub)
+	sub = ReverseSubstitution(lefts, inputs, rights, outputs)
+	lookup.add(sub)
 
 def read_single_pos(single, lookup):
 	# Type 1: Adjust position of a single glyph
@@ -262,18 +330,63 @@ def read_single_pos(single, lookup):
 			# 1 -> XPlacement
 			# 2 -> YPlacement
 		elif child.tag == 'Value':
-			if form == '1':
-				x = int(child.get('XPlacement'))
-				adjustments.append({'XPlacement': x})
-			else:
-				y = int(child.get('YPlacement'))
-				adjustments.append({'YPlacement': y})
+			placement = {}
+			for field in ['XPlacement', 'YPlacement']:
+				if child.get(field) is not None:
+					placement[field] = int(child.get(field))
+			adjustments.append(placement)
 		else:
 			print('Unexpected in SinglePos', child)
+	if len(adjustments) == 1:
+		# Format 1: same value for all glyphs
+		adjustments = adjustments * len(glyphs)
 	adjs = [{'glyph': g, 'placement': a} for (g, a) in zip(glyphs, adjustments)]
 	posit = SingleAdjustment(form, adjs)
 	lookup.add_positioning(posit)
 
+def read_value(elem):
+	if elem is None:
+		return {}
+	return {field: int(value) for field, value in elem.attrib.items()}
+
+def read_pair_pos(pair, lookup):
+	# Type 2: Adjust positions of a pair of glyphs
+	glyphs = read_coverage(pair.find('Coverage'))
+	second_values = int(pair.find('ValueFormat2').get('value')) != 0
+	if pair.get('Format') == '1':
+		firsts = []
+		seconds = []
+		records = []
+		for pair_set in pair.findall('PairSet'):
+			first = glyphs[int(pair_set.get('index'))]
+			for record in pair_set.findall('PairValueRecord'):
+				firsts.append(first)
+				seconds.append(record.find('SecondGlyph').get('value'))
+				records.append(record)
+		values1 = new_values(len(records))
+		values2 = new_values(len(records)) if second_values else None
+		for index, record in enumerate(records):
+			set_value(values1, index, read_value(record.find('Value1')))
+			if second_values:
+				set_value(values2, index, read_value(record.find('Value2')))
+		posit = PairAdjustment1(firsts, seconds, values1, values2)
+	else:
+		classes1 = read_class_def(pair.find('ClassDef1'))
+		classes2 = read_class_def(pair.find('ClassDef2'))
+		class1_records = pair.findall('Class1Record')
+		n_classes2 = len(class1_records[0].findall('Class2Record')) if class1_records else 0
+		values1 = new_values((len(class1_records), n_classes2))
+		values2 = new_values((len(class1_records), n_classes2)) if second_values else None
+		for class1_record in class1_records:
+			cl1 = int(class1_record.get('index'))
+			for class2_record in class1_record.findall('Class2Record'):
+				cl2 = int(class2_record.get('index'))
+				set_value(values1, (cl1, cl2), read_value(class2_record.find('Value1')))
+				if second_values:
+					set_value(values2, (cl1, cl2), read_value(class2_record.find('Value2')))
+		posit = PairAdjustment2(glyphs, classes1, classes2, values1, values2)
+	lookup.add_positioning(posit)
+
 def read_mark_base_pos(mark_base, lookup):
 	# Type 4: Attach a combining mark to a base glyph
 	marks = []
@@ -303,6 +416,8 @@ def read_mark_base_pos(mark_base, lookup):
 			for array_elem in child.findall('BaseRecord'):
 				index = int(array_elem.get('index'))
 				for anchor_elem in array_elem.findall('BaseAnchor'):
+					if anchor_elem.get('empty') is not None:
+						continue
 					class_index = int(anchor_elem.get('index'))
 					x = int(anchor_elem.find('XCoordinate').get('value'))
 					y = int(anchor_elem.find('YCoordinate').get('value'))
@@ -341,6 +456,8 @@ def read_mark_mark_pos(mark_base, lookup):
 			for array_elem in child.findall('Mark2Record'):
 				index = int(array_elem.get('index'))
 				for anchor_elem in array_elem.findall('Mark2Anchor'):
+					if anchor_elem.get('empty') is not None:
+						continue
 					mark_index = int(anchor_elem.get('index'))
 					x = int(anchor_elem.find('XCoordinate').get('value'))
 					y = int(anchor_elem.find('YCoordinate').get('value'))
@@ -367,27 +484,38 @@ def read_chain_pos(chain, lookup):
 			output = int(child.find('LookupListIndex').get('value'))
 		else:
 			print('Unexpected in ChainContextPos', child)
-	posit = ChainPos(left, input, right, output)
+	posit = ChainPos(left[::-1], input, right, output)
 	lookup.add_positioning(posit)
 
+subst_tags = ['SingleSubst', 'MultipleSubst', 'LigatureSubst', 'ChainContextSubst', \
+	'ReverseChainSingleSubst']
+
+def read_subst(child, lookup, context):
+	if child.tag == 'SingleSubst':
+		read_single_subst(child, lookup)
+	elif child.tag == 'MultipleSubst':
+		read_mult_subst(child, lookup)
+	elif child.tag == 'LigatureSubst':
+		read_ligature_subst(child, lookup)
+	elif child.tag == 'ChainContextSubst' and child.get('Format') == '1':
+		read_chain_subst1(child, lookup)
+	elif child.tag == 'ChainContextSubst' and child.get('Format') == '2':
+		read_chain_subst2(child, lookup)
+	elif child.tag == 'ChainContextSubst' and child.get('Format') == '3':
+		read_chain_subst3(child, lookup)
+	elif child.tag == 'ReverseChainSingleSubst':
+		read_reverse_subst(child, lookup)
+	else:
+		print('Unexpected in ' + context, child)
+
 def read_ext_subst(ext, lookup):
 	for child in ext.findall('*'):
 		if child.tag is None:
 			None
 		elif child.tag == 'ExtensionLookupType':
 			None
-		elif child.tag == 'SingleSubst':
-			read_single_subst(child, lookup)
-		elif child.tag == 'MultipleSubst':
-			read_mult_subst(child, lookup)
-		elif child.tag == 'LigatureSubst':
-			read_ligature_subst(child, lookup)
-		elif child.tag == 'ChainContextSubst' and child.get('Format') == '3':
-			read_chain_subst3(child, lookup)
-		elif child.tag == 'ReverseChainSingleSubst':
-			read_reverse_subst(child, lookup)
 		else:
-			print('Unexpected in ExtensionSubst', child)
+			read_subst(child, lookup, 'ExtensionSubst')
 
 def read_GSUB_lookup(lookup_elem, font):
 	index = int(lookup_elem.get('index'))
@@ -404,8 +532,8 @@ def read_GSUB_lookup(lookup_elem, font):
 			read_flag(child, lookup)
 		elif child.tag == 'ExtensionSubst':
 			read_ext_subst(child, lookup)
-		elif child.tag == 'SingleSubst':
-			read_single_subst(child, lookup)
+		elif child.tag in subst_tags:
+			read_subst(child, lookup, 'GSUB Lookup')
 		elif child.tag == 'MarkFilteringSet':
 			lookup.filter_set = int(child.get('value'))
 		else:
@@ -427,26 +555,37 @@ def read_GSUB(table, font):
 	for lookup_elem in lookup_elems:
 		read_GSUB_lookup(lookup_elem, font)
 
+pos_tags = ['SinglePos', 'PairPos', 'MarkBasePos', 'MarkMarkPos', 'ChainContextPos']
+
+def read_pos(child, lookup, context):
+	if child.tag == 'SinglePos':
+		read_single_pos(child, lookup)
+	elif child.tag == 'PairPos':
+		read_pair_pos(child, lookup)
+	elif child.tag == 'MarkBasePos':
+		read_mark_base_pos(child, lookup)
+	elif child.tag == 'MarkMarkPos':
+		read_mark_mark_pos(child, lookup)
+	elif child.tag == 'ChainContextPos' and child.get('Format') == '3':
+		read_chain_pos(child, lookup)
+	else:
+		print('Unexpected in ' + context, child)
+
 def read_ext_pos(ext, lookup):
 	for child in ext.findall('*'):
 		if child.tag is None:
 			None
 		elif child.tag == 'ExtensionLookupType':
 			None
-		elif child.tag == 'SinglePos':
-			read_single_pos(child, lookup)
-		elif child.tag == 'MarkBasePos':
-			read_mark_base_pos(child, lookup)
-		elif child.tag == 'MarkMarkPos':
-			read_mark_mark_pos(child, lookup)
-		elif child.tag == 'ChainContextPos':
-			read_chain_pos(child, lookup)
 		else:
-			print('Unexpected in ExtensionSubst', child)
+			read_pos(child, lookup, 'ExtensionPos')
 
 def read_GPOS_lookup(lookup_elem, font):
 	index = int(lookup_elem.get('index'))
-	typ ='9/' +  lookup_elem.find('.//ExtensionLookupType').get('value')
+	if lookup_elem.find('.//ExtensionLookupType') is not None:
+		typ ='9/' +  lookup_elem.find('.//ExtensionLookupType').get('value')
+	else:
+		typ = lookup_elem.find('LookupType').get('value')
 	lookup = GPOS_Lookup(index, typ)
 	for child in lookup_elem.findall('*'):
 		if child.tag == 'LookupType':
@@ -455,6 +594,8 @@ def read_GPOS_lookup(lookup_elem, font):
 			read_flag(child, lookup)
 		elif child.tag == 'ExtensionPos':
 			read_ext_pos(child, lookup)
+		elif child.tag in pos_tags:
+			read_pos(child, lookup, 'GPOS Lookup')
 		elif child.tag == 'MarkFilteringSet':
 			lookup.filter_set = int(child.get('value'))
 		else:
@@ -477,32 +618,174 @@ def read_GPOS(table, font):
 	for lookup_elem in lookup_elems:
 		read_GPOS_lookup(lookup_elem, font)
 
-def read_ttx(filename):
+# Read one top-level table of a TTX file. Tables are independent, so
+# they can be read in any order.
+def read_table(elem, font):
+	tag = elem.tag
+	if tag in ['head', 'hhea', 'vhea', 'maxp', 'OS_2']:
+		read_properties_table(elem, tag, font)
+	elif tag == 'name':
+		read_name(elem, font)
+	elif tag == 'CPAL':
+		read_CPAL(elem, font)
+	elif tag == 'cmap':
+		read_cmap(elem.find('cmap_format_4[@platformID="0"]'), font.charset_large)
+		read_cmap(elem.find('cmap_format_6'), font.charset_small)
+		read_cmap(elem.find('cmap_format_12[@platformID="0"]'), font.charset_total)
+		read_cmap14(elem.find('cmap_format_14'), font)
+	elif tag == 'GlyphOrder':
+		read_GlyphOrder(elem, font)
+	elif tag == 'hmtx':
+		read_hmtx(elem, font)
+	elif tag == 'vmtx':
+		read_vmtx(elem, font)
+	elif tag == 'post':
+		read_post(elem, font)
+	elif tag == 'glyf':
+		read_glyf(elem, font)
+	elif tag == 'COLR':
+		read_COLR(elem, font)
+	elif tag == 'GDEF':
+		read_GlyphClassDef(elem.find('GlyphClassDef'), font)
+		read_MarkAttachClassDef(elem.find('MarkAttachClassDef'), font)
+		read_MarkGlyphSetsDef(elem.find('MarkGlyphSetsDef'), font)
+	elif tag == 'GSUB':
+		read_GSUB(elem, font)
+	elif tag == 'GPOS':
+		read_GPOS(elem, font)
+
+# Font attributes filled by each table.
+table_attributes = {
+	'head': ['properties'],
+	'hhea': ['properties'],
+	'vhea': ['properties'],
+	'maxp': ['properties'],
+	'OS_2': ['properties'],
+	'name': ['name'],
+	'CPAL': ['palettes'],
+	'cmap': ['charset_large', 'charset_small', 'charset_total', 'vs_to_name'],
+	'GlyphOrder': ['glyphs'],
+	'hmtx': ['width', 'lsb'],
+	'vmtx': ['height', 'tsb'],
+	'post': ['post', 'extra_names'],
+	'glyf': ['xmin', 'ymin', 'xmax', 'ymax', 'contours', 'components'],
+	'COLR': ['color_layers'],
+	'GDEF': ['glyph_to_class', 'mark_to_class', 'index_to_glyphs'],
+	'GSUB': ['script', 'GSUB_features', 'GSUB_lookup_list', 'GSUB_lookups', \
+		'GSUB_lookup_index_to_feature'],
+	'GPOS': ['GPOS_features', 'GPOS_lookup_list', 'GPOS_lookups', \
+		'GPOS_lookup_index_to_feature'],
+}
+
+# Tables needed to shape text.
+shaping_tables = ['cmap', 'GlyphOrder', 'hmtx', 'GDEF', 'GSUB', 'GPOS']
+
+# Tables read only once one of their attributes is used. Subclasses for
+# other file formats override read.
+class LazyTables:
+	def __init__(self, filename, tables):
+		self.filename = filename
+		self.tables = set(tables)
+
+	def provides(self, attr):
+		return any(attr in table_attributes[table] for table in self.tables)
+
+	def load(self, font, attr):
+		tables = {table for table in self.tables if attr in table_attributes[table]}
+		empty = Font()
+		for table in tables:
+			for table_attr in table_attributes[table]:
+				setattr(font, table_attr, getattr(empty, table_attr))
+		self.tables -= tables
+		self.read(font, tables)
+
+	def read(self, font, tables):
+		read_tables_stream(self.filename, font, tables)
+
+# The tables, and other tables filling the same attributes.
+def tables_with_shared_attributes(tables):
+	tables = set(tables)
+	attrs = {attr for table in tables for attr in table_attributes.get(table, [])}
+	for table, table_attrs in table_attributes.items():
+		if any(attr in attrs for attr in table_attrs):
+			tables.add(table)
+	return tables
+
+# Read the selected tables now, and the others when they are first used.
+def read_selected_tables(filename, font, tables):
+	eager = tables_with_shared_attributes(tables)
+	read_tables_stream(filename, font, eager)
+	lazy = set(table_attributes) - eager
+	for attr in {attr for table in lazy for attr in table_attributes[table]}:
+		delattr(font, attr)
+	font.lazy_tables = LazyTables(filename, lazy)
+
+# With tables, a list such as shaping_tables, other tables are only read
+# once the font attributes they fill are first used.
+def read_ttx(filename, intern=False, tables=None):
 	font = Font()
-	doc = etree.parse(filename)
-	read_properties(doc, 'head', font)
-	read_properties(doc, 'hhea', font)
-	read_properties(doc, 'vhea', font)
-	read_properties(doc, 'maxp', font)
-	read_properties(doc, 'OS_2', font)
-	read_name(doc.find('name'), font)
-	read_CPAL(doc.find('CPAL'), font)
-
-	read_cmap(doc.find('cmap/cmap_format_4[@platformID="0"]'), font.charset_large)
-	read_cmap(doc.find('cmap/cmap_format_6'), font.charset_small)
-	read_cmap(doc.find('cmap/cmap_format_12[@platformID="0"]'), font.charset_total)
-	read_cmap14(doc.find('cmap/cmap_format_14'), font)
-
-	read_GlyphOrder(doc.find('GlyphOrder'), font)
-	read_hmtx(doc.find('hmtx'), font)
-	read_vmtx(doc.find('vmtx'), font)
-	read_post(doc.find('post'), font)
-	read_glyf(doc.find('glyf'), font)
-	read_COLR(doc.find('COLR'), font)
-
-	read_GlyphClassDef(doc.find('GDEF/GlyphClassDef'), font)
-	read_MarkAttachClassDef(doc.find('GDEF/MarkAttachClassDef'), font)
-	read_MarkGlyphSetsDef(doc.find('GDEF/MarkGlyphSetsDef'), font)
-	read_GSUB(doc.find('GSUB'), font)
-	read_GPOS(doc.find('GPOS'), font)
+	if tables is None:
+		doc = etree.parse(filename)
+		for elem in doc.getroot():
+			read_table(elem, font)
+	else:
+		read_selected_tables(filename, font, tables)
+	if intern:
+		font.intern_glyphs()
 	return font
+
+# As read_ttx, but each table is read as soon as it has been parsed and is
+# then discarded. Glyphs in glyf are read and discarded one by one.
+def read_ttx_stream(filename, intern=False, tables=None):
+	font = Font()
+	if tables is None:
+		read_tables_stream(filename, font)
+	else:
+		read_selected_tables(filename, font, tables)
+	if intern:
+		font.intern_glyphs()
+	return font
+
+def read_tables_stream(filename, font, tables=None):
+	for event, elem in etree.iterparse(filename, events=('end',)):
+		parent = elem.getparent()
+		if parent is None:
+			continue
+		elif parent.getparent() is None:
+			if elem.tag != 'glyf' and (tables is None or elem.tag in tables):
+				read_table(elem, font)
+		elif elem.tag == 'TTGlyph' and parent.tag == 'glyf' and \
+				parent.getparent().getparent() is None:
+			if tables is None or 'glyf' in tables:
+				read_TTGlyph(elem, font)
+		else:
+			continue
+		elem.clear()
+		while elem.getprevious() is not None:
+			del parent[0]
+
+def same_values(val1, val2):
+	if type(val1) != type(val2):
+		return False
+	elif isinstance(val1, dict):
+		return val1.keys() == val2.keys() and \
+			all(same_values(val1[key], val2[key]) for key in val1)
+	elif isinstance(val1, (list, tuple)):
+		return len(val1) == len(val2) and \
+			all(same_values(v1, v2) for v1, v2 in zip(val1, val2))
+	elif isinstance(val1, np.ndarray):
+		return val1.dtype == val2.dtype and np.array_equal(val1, val2)
+	elif hasattr(val1, '__dict__'):
+		# Lookups refer back to their font, which is compared elsewhere.
+		return same_values({k: v for k, v in vars(val1).items() if k != 'font'}, \
+			{k: v for k, v in vars(val2).items() if k != 'font'})
+	else:
+		return val1 == val2
+
+# Names of attributes in which two fonts differ, for checking readers
+# against each other. Attributes of tables not yet read are read first.
+def font_differences(font1, font2, attrs=None):
+	if attrs is None:
+		attrs = set(vars(font1)).union(vars(font2)) - {'lazy_tables'}
+	return [attr for attr in sorted(attrs) \
+		if not same_values(getattr(font1, attr, None), getattr(font2, attr, None))]